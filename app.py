@@ -1,74 +1,180 @@
+import base64
+import hashlib
 import os
+import re
+import secrets
+import threading
+from collections import namedtuple
+from functools import lru_cache
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash
+from uuid import uuid4
+import click
+from flask import (Blueprint, Flask, current_app, render_template, stream_template, get_flashed_messages, request, redirect, url_for, flash, abort, g, has_request_context, jsonify,
+                   make_response, session)
+from flask.cli import AppGroup
 from flask_caching import Cache
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_sqlalchemy import SQLAlchemy
-from markupsafe import Markup
-from werkzeug.security import generate_password_hash, check_password_hash
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.urandom(24)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///forum.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['CACHE_TYPE'] = 'simple'
-app.config['CACHE_DEFAULT_TIMEOUT'] = 300
-app.config['POSTS_PER_PAGE'] = 10
-app.config['TOPICS_PER_PAGE'] = 20
+from flask_sqlalchemy.session import Session
+from markupsafe import Markup, escape
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.elements import TextClause
+from werkzeug.http import is_resource_modified
+from assets import Assets
+from compression import Compress
+from credentials import CredentialService, CredentialServiceBusy
+from jobs import JobQueue
+from profiling import RequestProfiler
+from sqlite_tuning import DEFAULT_PRAGMAS, create_read_only_engine, is_file_database, tune_engine
+def configure(app):
+    """Load the settings from the environment."""
+    # Every worker must sign sessions with the same key; see create_app for the fallback
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///forum.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # SQLite tuning: PRAGMAs applied to every connection (see sqlite_tuning.py),
+    # the connection pool, and an optional read-only pool for GET requests
+    app.config['SQLITE_PRAGMAS'] = dict(DEFAULT_PRAGMAS)
+    app.config['SQLITE_READ_SPLIT'] = os.environ.get('SQLITE_READ_SPLIT', '0') == '1'
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': 10,
+    }
+    # Cache backend: cache_backends.LRUCache, FileSystemCache, RedisCache or
+    # cache_backends.TwoTierCache (see cache_backends.py)
+    app.config['CACHE_TYPE'] = os.environ.get('CACHE_TYPE', 'cache_backends.LRUCache')
+    app.config['CACHE_DEFAULT_TIMEOUT'] = 300
+    app.config['CACHE_THRESHOLD'] = int(os.environ.get('CACHE_THRESHOLD', 2000))
+    for key in ('CACHE_DIR', 'CACHE_REDIS_URL', 'CACHE_KEY_PREFIX'):
+        if os.environ.get(key):
+            app.config[key] = os.environ[key]
+    app.config['POSTS_PER_PAGE'] = 10
+    app.config['TOPICS_PER_PAGE'] = 20
+    app.config['MAX_PAGE_NUMBER'] = 10
+    app.config['CONVERSATIONS_PER_PAGE'] = 20
+    app.config['MESSAGES_PER_PAGE'] = 50
+    app.config['SEARCH_RESULTS_PER_PAGE'] = 20
+    app.config['ADMIN_USERS_PER_PAGE'] = 25
+    app.config['API_BATCH_SIZE'] = 50
+    app.config['FRAGMENT_CACHE_TIMEOUT'] = 300
+    # How long a signed-in user's identity snapshot is cached (see load_user)
+    app.config['IDENTITY_CACHE_TIMEOUT'] = int(os.environ.get('IDENTITY_CACHE_TIMEOUT', 300))
+    # How long a shared cache (reverse proxy, CDN) may serve anonymous pages
+    app.config['PUBLIC_CACHE_MAX_AGE'] = int(os.environ.get('PUBLIC_CACHE_MAX_AGE', 60))
+    # Password hashing (see credentials.py) and login rate limits
+    app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 4))
+    app.config['PASSWORD_HASH_QUEUE_LIMIT'] = int(os.environ.get('PASSWORD_HASH_QUEUE_LIMIT', 16))
+    app.config['LOGIN_LIMIT_PER_IP'] = os.environ.get('LOGIN_LIMIT_PER_IP', '20 per minute; 200 per hour')
+    app.config['LOGIN_LIMIT_PER_USERNAME'] = os.environ.get('LOGIN_LIMIT_PER_USERNAME', '5 per minute; 30 per hour')
+    if os.environ.get('RATELIMIT_STORAGE_URI'):
+        app.config['RATELIMIT_STORAGE_URI'] = os.environ['RATELIMIT_STORAGE_URI']
+    # Long pages are streamed in chunks of about this many characters
+    app.config['STREAM_CHUNK_SIZE'] = 1024
+    # Serve static files under the names built by flask forum build-assets (see assets.py)
+    app.config['ASSETS_FINGERPRINT'] = os.environ.get('ASSETS_FINGERPRINT', '1') == '1'
+    # Response compression (see compression.py)
+    app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+    # Background jobs (see jobs.py)
+    app.config['JOBS_WORKERS'] = int(os.environ.get('JOBS_WORKERS', 2))
+    app.config['JOBS_MAX_ATTEMPTS'] = int(os.environ.get('JOBS_MAX_ATTEMPTS', 5))
+    # Request profiling (see profiling.py); off unless PROFILING_ENABLED=1
+    app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED', '0') == '1'
+    app.config['PROFILING_QUERY_BUDGET'] = int(os.environ.get('PROFILING_QUERY_BUDGET', 30))
+# Database sessions
+# With SQLITE_READ_SPLIT on, SELECTs issued while serving GET/HEAD requests
+# go to a second pool that opens the database read-only. Once a transaction
+# writes it stays on the primary engine until it ends, so it reads its own
+# writes; CLI commands and POST requests always use the primary.
+_read_engines = {}
+_read_engines_lock = threading.Lock()
+def read_engine(engine):
+    if not is_file_database(engine.url):
+        return engine
+    with _read_engines_lock:
+        if engine not in _read_engines:
+            _read_engines[engine] = create_read_only_engine(
+                engine.url, current_app.config['SQLITE_PRAGMAS'], **current_app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+        return _read_engines[engine]
+def _is_read(clause):
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip().upper().startswith('SELECT')
+    return getattr(clause, 'is_select', False)
+class ReadSplitSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if (bind is not None or not current_app.config['SQLITE_READ_SPLIT'] or not has_request_context()
+                or request.method not in ('GET', 'HEAD')):
+            return engine
+        if self.info.get('wrote') or self._flushing or not _is_read(clause):
+            self.info['wrote'] = True
+            return engine
+        return read_engine(engine)
+@event.listens_for(ReadSplitSession, 'after_transaction_end')
+def _reset_read_split(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('wrote', None)
 # Initialize extensions
-db = SQLAlchemy(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
-cache = Cache(app)
-limiter = Limiter(
-    key_func=get_remote_address,
-    app=app
-)
+# They are bound to the app in create_app
+db = SQLAlchemy(session_options={'class_': ReadSplitSession})
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
+cache = Cache()
+limiter = Limiter(key_func=get_remote_address)
+profiler = RequestProfiler()
+credentials = CredentialService()
+jobs = JobQueue()
+compress = Compress()
+assets = Assets()
+bp = Blueprint('main', __name__)
 # Custom Jinja2 filters
-@app.template_filter('nl2br')
+@bp.app_template_filter('nl2br')
 def nl2br(value):
     if value:
         value = str(value)
         return Markup(value.replace('\n', '<br>'))
     return value
 
-@app.template_filter('format_content')
+# Content rendering
+# Bump RENDERER_VERSION whenever render_content's output changes; stored HTML
+# rendered by an older version is rendered again in memory when it is read
+# until 'flask forum render-content' stores the new HTML.
+RENDERER_VERSION = 2
+CODE_BLOCK_PATTERN = re.compile(r'```([\w-]*)\s*(.*?)\s*```', re.DOTALL)
+def render_content(value):
+    """Render post/comment markup: fenced code blocks become Prism-ready
+    ``<pre>`` blocks and the text outside them is escaped, with newlines
+    becoming ``<br>``."""
+    def text(chunk):
+        return str(escape(chunk)).replace('\n', '<br>')
+    result = []
+    position = 0
+    for match in CODE_BLOCK_PATTERN.finditer(value):
+        result.append(text(value[position:match.start()]))
+        language = match.group(1).strip() or 'plaintext'
+        # Normalize line breaks and escape HTML entities in the code
+        code = match.group(2).replace('\r\n', '\n')
+        code = code.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        result.append(f'<pre class="line-numbers"><code class="language-{language}">{code}</code></pre>')
+        position = match.end()
+    result.append(text(value[position:]))
+    return ''.join(result)
+# In-process cache for content whose HTML has not been persisted yet
+_render_content_cached = lru_cache(maxsize=2048)(render_content)
+def content_columns(content):
+    """Column values for a new Post or Comment, with its HTML pre-rendered."""
+    return {'content': content, 'content_html': render_content(content), 'content_html_version': RENDERER_VERSION}
+@bp.app_template_filter('format_content')
 def format_content(value):
     if not value:
         return value
-
-    value = str(value)
-
-    # Process code blocks
-    import re
-    # Updated pattern to be more flexible with whitespace and newlines
-    pattern = r'```([\w-]*)\s*(.*?)\s*```'
-
-    def replace_code_block(match):
-        language = match.group(1).strip() or 'plaintext'
-        code = match.group(2)
-        # Preserve line breaks in the code
-        code = code.replace('\r\n', '\n')  # Normalize line breaks
-        # Escape HTML entities in the code
-        code = code.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
-        return f'<pre class="line-numbers"><code class="language-{language}">{code}</code></pre>'
-
-    # Replace code blocks with properly formatted HTML
-    processed_value = re.sub(pattern, replace_code_block, value, flags=re.DOTALL)
-
-    # Apply nl2br to the rest of the content (outside code blocks)
-    # We need to split by the pre tags and apply nl2br only to the parts outside
-    parts = re.split(r'(<pre class="line-numbers"><code class="language-.*?">.*?</code></pre>)', processed_value, flags=re.DOTALL)
-    result = []
-    for i, part in enumerate(parts):
-        if i % 2 == 0:  # Even parts are outside code blocks
-            result.append(part.replace('\n', '<br>'))
-        else:  # Odd parts are code blocks
-            result.append(part)
-
-    return Markup(''.join(result))
-@app.template_filter('time_since')
+    return Markup(_render_content_cached(str(value)))
+@bp.app_template_filter('time_since')
 def time_since(dt):
     now = datetime.utcnow()
     diff = now - dt
@@ -90,48 +196,77 @@ def time_since(dt):
         return "just now"
 # Models
 class User(db.Model, UserMixin):
+    __table_args__ = (db.Index('ix_user_post_count', 'post_count', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False, index=True)
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(256))
     bio = db.Column(db.Text, nullable=True)
     join_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     is_admin = db.Column(db.Boolean, default=False)
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     posts = db.relationship('Post', backref='author', lazy='dynamic', cascade='all, delete-orphan')
     comments = db.relationship('Comment', backref='author', lazy='dynamic', cascade='all, delete-orphan')
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = credentials.hash(password)
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        # Upgrades the stored hash when the hashing parameters have changed;
+        # the caller's commit saves it
+        valid, new_hash = credentials.verify(self.password_hash, password)
+        if new_hash:
+            self.password_hash = new_hash
+        return valid
+    def load(self):
+        return self
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False, index=True)
     description = db.Column(db.Text, nullable=True)
+    topic_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     topics = db.relationship('Topic', backref='category', lazy='dynamic', cascade='all, delete-orphan')
 class Topic(db.Model):
+    __table_args__ = (
+        db.Index('ix_topic_category_created', 'category_id', 'created_at', 'id'),
+        db.Index('ix_topic_category_last_post', 'category_id', 'last_post_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False, index=True)
     description = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False, index=True)
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_post_at = db.Column(db.DateTime, nullable=True, index=True)
+    first_post_author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     posts = db.relationship('Post', backref='topic', lazy='dynamic', cascade='all, delete-orphan')
+    first_post_author = db.relationship('User', foreign_keys=[first_post_author_id])
 class Post(db.Model):
+    __table_args__ = (
+        db.Index('ix_post_topic_created', 'topic_id', 'created_at', 'id'),
+        db.Index('ix_post_user_created', 'user_id', 'created_at', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
+    content_html = db.Column(db.Text, nullable=True)
+    content_html_version = db.Column(db.Integer, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'), nullable=False, index=True)
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     comments = db.relationship('Comment', backref='post', lazy='dynamic', cascade='all, delete-orphan')
 class Comment(db.Model):
+    __table_args__ = (db.Index('ix_comment_post_created', 'post_id', 'created_at', 'id'),)
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
+    content_html = db.Column(db.Text, nullable=True)
+    content_html_version = db.Column(db.Integer, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False, index=True)
 
 class Message(db.Model):
+    __table_args__ = (db.Index('ix_message_pair_created', 'sender_id', 'recipient_id', 'created_at'),)
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
@@ -141,96 +276,766 @@ class Message(db.Model):
 
     sender = db.relationship('User', foreign_keys=[sender_id], backref=db.backref('sent_messages', lazy='dynamic'))
     recipient = db.relationship('User', foreign_keys=[recipient_id], backref=db.backref('received_messages', lazy='dynamic'))
+# Denormalized counters
+def rebuild_counters(categories=None, topics=None, users=None, posts=None):
+    """Recompute the denormalized counters from the rows they summarize.
+
+    Without arguments every row is recomputed; otherwise only the rows whose
+    ids are listed, so the same statements serve the write routes' jobs.
+    """
+    def scalar(stmt):
+        return stmt.scalar_subquery()
+    targets = [
+        (Category, categories, {'topic_count': scalar(
+            db.select(db.func.count(Topic.id)).where(Topic.category_id == Category.id))}),
+        (Topic, topics, {
+            'post_count': scalar(db.select(db.func.count(Post.id)).where(Post.topic_id == Topic.id)),
+            'last_post_at': scalar(db.select(db.func.max(Post.created_at)).where(Post.topic_id == Topic.id)),
+            'first_post_author_id': scalar(
+                db.select(Post.user_id).where(Post.topic_id == Topic.id)
+                .order_by(Post.created_at, Post.id).limit(1))}),
+        (User, users, {'post_count': scalar(
+            db.select(db.func.count(Post.id)).where(Post.user_id == User.id))}),
+        (Post, posts, {'comment_count': scalar(
+            db.select(db.func.count(Comment.id)).where(Comment.post_id == Post.id))}),
+    ]
+    everything = all(ids is None for _, ids, _ in targets)
+    for model, ids, values in targets:
+        if everything:
+            stmt = db.update(model).values(**values)
+        elif ids:
+            stmt = db.update(model).where(model.id.in_(ids)).values(**values)
+        else:
+            continue
+        db.session.execute(stmt.execution_options(synchronize_session=False))
+    db.session.commit()
+# Background jobs
+# Write routes commit only their own rows; counters and the caches showing
+# them are refreshed by jobs queued in the same transaction (see jobs.py).
+def refresh_counters_later(topic, post):
+    jobs.enqueue('refresh_counters', {'categories': [topic.category_id], 'topics': [topic.id], 'users': [post.user_id]})
+@jobs.handler('refresh_counters')
+def refresh_counters_job(payloads):
+    ids = {'categories': set(), 'topics': set(), 'users': set(), 'posts': set()}
+    for payload in payloads:
+        for key, values in payload.items():
+            ids[key].update(values)
+    rebuild_counters(**{key: list(values) for key, values in ids.items()})
+    # Fragments cached before the counts changed would keep showing the old ones
+    topic_ids = ids['topics'] | set(db.session.execute(
+        db.select(Post.topic_id).where(Post.id.in_(ids['posts']))).scalars())
+    bump_content_version(*(f'topic:{topic_id}' for topic_id in topic_ids),
+                         *(f'category:{category_id}' for category_id in ids['categories']), 'stats')
+def upgrade_schema():
+    """Add columns declared on the models but missing from an older database.
+
+    Also creates any declared index the database lacks. Returns the list of
+    ``table.column`` names that were added.
+    """
+    inspector = db.inspect(db.engine)
+    added = []
+    new_indexes = False
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            missing = [column for column in table.columns if column.name not in existing]
+            for column in missing:
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(dialect=conn.dialect)}'
+                if column.server_default is not None:
+                    ddl += f" NOT NULL DEFAULT '{column.server_default.arg}'"
+                conn.execute(db.text(ddl))
+                added.append(f'{table.name}.{column.name}')
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+                    new_indexes = True
+        if new_indexes and conn.dialect.name == 'sqlite':
+            # Without fresh statistics the planner may ignore the new covering indexes
+            conn.exec_driver_sql('ANALYZE')
+    return added
+# Keyset pagination
+# Pages are addressed by an opaque cursor over (created_at, id) so any page
+# costs the same as the first. Plain page numbers are still honoured up to
+# MAX_PAGE_NUMBER through OFFSET for links that predate the cursors.
+KeysetPage = namedtuple('KeysetPage', 'items next_cursor prev_cursor')
+def encode_cursor(row):
+    raw = f'{row.created_at.isoformat()}|{row.id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        created_at, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except ValueError:
+        abort(404)
+def keyset_paginate(query, model, per_page, after=None, before=None, page=1, descending=False):
+    """Return one page of ``query`` ordered by ``(model.created_at, model.id)``.
+
+    ``model`` is a mapped class or the column collection (``.c``) of a subquery.
+
+    ``after`` and ``before`` are cursors taken from a neighbouring page's
+    ``next_cursor``/``prev_cursor``; without either, ``page`` selects a page
+    by offset.
+    """
+    key = db.tuple_(model.created_at, model.id)
+    ascending_order = (model.created_at, model.id)
+    descending_order = (model.created_at.desc(), model.id.desc())
+    forward, backward = (descending_order, ascending_order) if descending else (ascending_order, descending_order)
+    if before:
+        cursor = decode_cursor(before)
+        rows = query.filter(key > cursor if descending else key < cursor).order_by(
+            *backward).limit(per_page + 1).all()
+        has_earlier, has_later = len(rows) > per_page, True
+        items = rows[:per_page][::-1]
+    else:
+        query = query.order_by(*forward)
+        if after:
+            cursor = decode_cursor(after)
+            query = query.filter(key < cursor if descending else key > cursor)
+            has_earlier = True
+        else:
+            query = query.offset((page - 1) * per_page)
+            has_earlier = page > 1
+        rows = query.limit(per_page + 1).all()
+        has_later = len(rows) > per_page
+        items = rows[:per_page]
+    next_cursor = encode_cursor(items[-1]) if items and has_later else None
+    prev_cursor = encode_cursor(items[0]) if items and has_earlier else None
+    return KeysetPage(items, next_cursor, prev_cursor)
+def page_request(page):
+    """Read the pagination arguments of the current request.
+
+    Returns ``(after, before, page)``, or None when a page number is past
+    MAX_PAGE_NUMBER and the caller should send the reader to the first page.
+    """
+    if page > current_app.config['MAX_PAGE_NUMBER']:
+        return None
+    return request.args.get('after'), request.args.get('before'), max(page, 1)
+# Thread loading
+# Read-only view-models handed to topic.html; building them up front keeps the
+# template from lazily walking post.author / post.comments / comment.author.
+ThreadAuthor = namedtuple('ThreadAuthor', 'id username join_date')
+ThreadComment = namedtuple('ThreadComment', 'id content html created_at author')
+ThreadPost = namedtuple('ThreadPost', 'id content html created_at updated_at author comment_count comments')
+ThreadPage = namedtuple('ThreadPage', 'topic pagination posts')  # pagination is a KeysetPage
+def _author_view(user):
+    return ThreadAuthor(user.id, user.username, user.join_date)
+def stored_html(row):
+    """Return the persisted HTML of a Post or Comment, rendering it if missing or outdated.
+
+    Reads never write: outdated rows are stored again by the render-content command.
+    """
+    if row.content_html is not None and row.content_html_version == RENDERER_VERSION:
+        return Markup(row.content_html)
+    return Markup(_render_content_cached(row.content))
+def persist_html(rows):
+    """Store freshly rendered HTML for ``rows`` without touching ``updated_at``."""
+    for model in (Post, Comment):
+        params = [{'row_id': row.id, 'html': _render_content_cached(row.content)}
+                  for row in rows if isinstance(row, model)]
+        if params:
+            table = model.__table__
+            db.session.execute(
+                table.update().where(table.c.id == db.bindparam('row_id')).values(
+                    content_html=db.bindparam('html'), content_html_version=RENDERER_VERSION,
+                    updated_at=table.c.updated_at),
+                params)
+    if rows:
+        db.session.commit()
+def load_comments(post_ids, since=0):
+    """Comments on ``post_ids`` with an id above ``since``, grouped by post id, in one query."""
+    comments_by_post = {post_id: [] for post_id in post_ids}
+    if comments_by_post:
+        comments = Comment.query.filter(Comment.post_id.in_(comments_by_post), Comment.id > since).options(
+            db.joinedload(Comment.author)).order_by(Comment.created_at, Comment.id)
+        for comment in comments:
+            comments_by_post[comment.post_id].append(ThreadComment(
+                comment.id, comment.content, stored_html(comment), comment.created_at,
+                _author_view(comment.author)))
+    return comments_by_post
+def thread_posts(posts):
+    """ThreadPost view-models for ``posts``, whose authors must already be loaded."""
+    comments_by_post = load_comments([post.id for post in posts])
+    return tuple(
+        ThreadPost(post.id, post.content, stored_html(post), post.created_at, post.updated_at,
+                   _author_view(post.author), post.comment_count, tuple(comments_by_post[post.id]))
+        for post in posts)
+def load_thread_page(topic, per_page, after=None, before=None, page=1):
+    """Load one page of ``topic`` with its posts, comments and their authors.
+
+    Issues a fixed number of queries regardless of how many posts or comments
+    the page holds: the posts (with their authors) and a single query for
+    every comment on those posts.
+    """
+    pagination = keyset_paginate(
+        Post.query.filter_by(topic_id=topic.id).options(db.joinedload(Post.author)),
+        Post, per_page, after=after, before=before, page=page)
+    return ThreadPage(topic, pagination, thread_posts(pagination.items))
+def load_posts_since(topic_id, since, limit):
+    """Up to ``limit`` posts of a topic with an id above ``since``, oldest first."""
+    posts = Post.query.filter(Post.topic_id == topic_id, Post.id > since).options(
+        db.joinedload(Post.author)).order_by(Post.created_at, Post.id).limit(limit).all()
+    return thread_posts(posts)
+ThreadState = namedtuple('ThreadState', 'topic_id last_post_id last_comment_id')
+def thread_state(topic_id):
+    """The newest post and comment ids of a topic, read from indexes only.
+
+    Posts and comments are never edited or deleted, so these ids change
+    exactly when the thread does; ``topic_id`` is None if there is no such topic.
+    """
+    return ThreadState(*db.session.execute(db.select(
+        db.select(Topic.id).where(Topic.id == topic_id).scalar_subquery(),
+        db.select(db.func.max(Post.id)).where(Post.topic_id == topic_id).scalar_subquery(),
+        db.select(db.func.max(Comment.id)).join(Post, Post.id == Comment.post_id)
+        .where(Post.topic_id == topic_id).scalar_subquery(),
+    )).one())
+def _author_json(author):
+    return {
+        'id': author.id,
+        'username': author.username,
+        'profile_url': url_for('main.profile', username=author.username),
+        'join_date': author.join_date.strftime('%Y-%m-%d'),
+    }
+def comment_json(comment):
+    return {
+        'id': comment.id,
+        'html': str(comment.html),
+        'created_at': comment.created_at.isoformat(),
+        'author': _author_json(comment.author),
+    }
+def post_json(post):
+    return {
+        'id': post.id,
+        'html': str(post.html),
+        'created_at': post.created_at.isoformat(),
+        'author': _author_json(post.author),
+        'comment_count': post.comment_count,
+        'comments': [comment_json(comment) for comment in post.comments],
+    }
+# Full-text search
+# An FTS5 table over topic titles/descriptions, post bodies and comments, kept
+# in sync by triggers so every writer (routes, CLI, imports) updates it. The
+# rowid encodes the source row as id * 4 + kind so triggers touch one entry.
+SEARCH_KINDS = {1: 'topic', 2: 'post', 3: 'comment'}
+SEARCH_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+    "title, body, kind UNINDEXED, topic_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS search_topic_ai AFTER INSERT ON topic BEGIN "
+    "INSERT INTO search_index (rowid, title, body, kind, topic_id) "
+    "VALUES (new.id * 4 + 1, new.title, coalesce(new.description, ''), 'topic', new.id); END",
+    "CREATE TRIGGER IF NOT EXISTS search_topic_au AFTER UPDATE OF title, description ON topic BEGIN "
+    "DELETE FROM search_index WHERE rowid = old.id * 4 + 1; "
+    "INSERT INTO search_index (rowid, title, body, kind, topic_id) "
+    "VALUES (new.id * 4 + 1, new.title, coalesce(new.description, ''), 'topic', new.id); END",
+    "CREATE TRIGGER IF NOT EXISTS search_topic_ad AFTER DELETE ON topic BEGIN "
+    "DELETE FROM search_index WHERE rowid = old.id * 4 + 1; END",
+    "CREATE TRIGGER IF NOT EXISTS search_post_ai AFTER INSERT ON post BEGIN "
+    "INSERT INTO search_index (rowid, title, body, kind, topic_id) "
+    "VALUES (new.id * 4 + 2, '', new.content, 'post', new.topic_id); END",
+    "CREATE TRIGGER IF NOT EXISTS search_post_au AFTER UPDATE OF content ON post BEGIN "
+    "DELETE FROM search_index WHERE rowid = old.id * 4 + 2; "
+    "INSERT INTO search_index (rowid, title, body, kind, topic_id) "
+    "VALUES (new.id * 4 + 2, '', new.content, 'post', new.topic_id); END",
+    "CREATE TRIGGER IF NOT EXISTS search_post_ad AFTER DELETE ON post BEGIN "
+    "DELETE FROM search_index WHERE rowid = old.id * 4 + 2; END",
+    "CREATE TRIGGER IF NOT EXISTS search_comment_ai AFTER INSERT ON comment BEGIN "
+    "INSERT INTO search_index (rowid, title, body, kind, topic_id) "
+    "VALUES (new.id * 4 + 3, '', new.content, 'comment', (SELECT topic_id FROM post WHERE id = new.post_id)); END",
+    "CREATE TRIGGER IF NOT EXISTS search_comment_au AFTER UPDATE OF content ON comment BEGIN "
+    "DELETE FROM search_index WHERE rowid = old.id * 4 + 3; "
+    "INSERT INTO search_index (rowid, title, body, kind, topic_id) "
+    "VALUES (new.id * 4 + 3, '', new.content, 'comment', (SELECT topic_id FROM post WHERE id = new.post_id)); END",
+    "CREATE TRIGGER IF NOT EXISTS search_comment_ad AFTER DELETE ON comment BEGIN "
+    "DELETE FROM search_index WHERE rowid = old.id * 4 + 3; END",
+]
+SEARCH_FILL = [
+    "INSERT INTO search_index (rowid, title, body, kind, topic_id) "
+    "SELECT id * 4 + 1, title, coalesce(description, ''), 'topic', id FROM topic",
+    "INSERT INTO search_index (rowid, title, body, kind, topic_id) "
+    "SELECT id * 4 + 2, '', content, 'post', topic_id FROM post",
+    "INSERT INTO search_index (rowid, title, body, kind, topic_id) "
+    "SELECT comment.id * 4 + 3, '', comment.content, 'comment', post.topic_id "
+    "FROM comment JOIN post ON post.id = comment.post_id",
+]
+SearchHit = namedtuple('SearchHit', 'kind topic snippet')
+SearchPage = namedtuple('SearchPage', 'hits page per_page has_next')
+_SEARCH_TOKEN = re.compile(r'\w+')
+def search_index_enabled():
+    return db.engine.dialect.name == 'sqlite'
+def ensure_search_index():
+    """Create the search table and triggers, filling the table if it is new."""
+    if not search_index_enabled():
+        return
+    with db.engine.begin() as conn:
+        exists = conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'search_index'").first()
+        for ddl in SEARCH_SCHEMA:
+            conn.exec_driver_sql(ddl)
+        if not exists:
+            for statement in SEARCH_FILL:
+                conn.exec_driver_sql(statement)
+def rebuild_search_index():
+    """Drop every search entry and re-index the existing rows in bulk."""
+    with db.engine.begin() as conn:
+        for ddl in SEARCH_SCHEMA:
+            conn.exec_driver_sql(ddl)
+        conn.exec_driver_sql("DELETE FROM search_index")
+        for statement in SEARCH_FILL:
+            conn.exec_driver_sql(statement)
+        conn.exec_driver_sql("INSERT INTO search_index (search_index) VALUES ('optimize')")
+def _highlight(snippet):
+    # snippet() marks matches with \x02/\x03 so the text can be escaped first
+    return Markup(str(escape(snippet)).replace('\x02', '<mark>').replace('\x03', '</mark>'))
+def search_forum(query, page, per_page):
+    """Return one page of search hits for ``query``, best matches first."""
+    tokens = _SEARCH_TOKEN.findall(query)
+    if not tokens:
+        return SearchPage([], page, per_page, False)
+    offset = (page - 1) * per_page
+    if search_index_enabled():
+        # Every token must match, each as a prefix; titles weigh more than bodies
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        rows = db.session.execute(db.text(
+            "SELECT rowid, topic_id, snippet(search_index, -1, char(2), char(3), '…', 24) AS snippet "
+            "FROM search_index WHERE search_index MATCH :match "
+            "ORDER BY bm25(search_index, 10.0, 1.0) LIMIT :limit OFFSET :offset"),
+            {'match': match, 'limit': per_page + 1, 'offset': offset}).all()
+        results = [(SEARCH_KINDS[row.rowid % 4], row.topic_id, _highlight(row.snippet)) for row in rows]
+    else:
+        posts = Post.query.join(Topic).filter(
+            db.or_(Topic.title.contains(query), Post.content.contains(query))).order_by(
+            Post.created_at.desc()).limit(per_page + 1).offset(offset)
+        results = [('post', post.topic_id, escape(post.content[:200])) for post in posts]
+    has_next = len(results) > per_page
+    results = results[:per_page]
+    topics = {topic.id: topic for topic in Topic.query.options(db.joinedload(Topic.category)).filter(
+        Topic.id.in_({topic_id for _, topic_id, _ in results}))}
+    hits = [SearchHit(kind, topics[topic_id], snippet) for kind, topic_id, snippet in results if topic_id in topics]
+    return SearchPage(hits, page, per_page, has_next)
+# Fragment cache
+# Only user-independent page bodies are cached; the layout and per-user chrome
+# are rendered around them on every request. Keys embed a per-scope version
+# token that writes replace, so new content shows up immediately and stale
+# fragments simply age out.
+def content_version(scope):
+    key = f'version:{scope}'
+    version = cache.get(key)
+    if version is None:
+        version = uuid4().hex
+        if not cache.add(key, version, timeout=0):
+            version = cache.get(key) or version
+    return version
+def bump_content_version(*scopes):
+    for scope in scopes:
+        cache.set(f'version:{scope}', uuid4().hex, timeout=0)
+def cached_value(scope, name, compute, timeout=None):
+    """Return the cached value ``name`` of ``scope``, calling ``compute`` on a miss."""
+    key = f'cached:{scope}:{content_version(scope)}:{name}'
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout=timeout)
+    return value
+def cached_fragment(scope, name, render):
+    """Return the HTML fragment ``name`` of ``scope``, calling ``render`` on a miss."""
+    # Fragments only differ between anonymous and signed-in readers (reply/comment forms)
+    html = cached_value(scope, f'{name}:{int(current_user.is_authenticated)}', lambda: str(render()),
+                        timeout=current_app.config['FRAGMENT_CACHE_TIMEOUT'])
+    return Markup(html)
+# Site statistics
+# Global counts and recent-activity lists are shared by every page, so they
+# are computed once and cached under the 'stats' scope, which the write routes
+# bump. Per-user values are memoized on ``g`` for the length of a request.
+ForumCounts = namedtuple('ForumCounts', 'user_count category_count topic_count post_count')
+RecentTopic = namedtuple('RecentTopic', 'id title created_at')
+RecentPost = namedtuple('RecentPost', 'id topic_id topic_title author created_at')
+def forum_counts():
+    def compute():
+        def count(model):
+            return db.select(db.func.count(model.id)).scalar_subquery()
+        return ForumCounts(*db.session.execute(
+            db.select(count(User), count(Category), count(Topic), count(Post))).one())
+    return cached_value('stats', 'counts', compute)
+def recent_topics(limit=5):
+    def compute():
+        return [RecentTopic(topic.id, topic.title, topic.created_at)
+                for topic in Topic.query.order_by(Topic.created_at.desc()).limit(limit)]
+    return cached_value('stats', f'recent_topics:{limit}', compute)
+def recent_posts(limit=5):
+    def compute():
+        posts = Post.query.options(db.joinedload(Post.topic), db.joinedload(Post.author)).order_by(
+            Post.created_at.desc()).limit(limit)
+        return [RecentPost(post.id, post.topic_id, post.topic.title, post.author.username, post.created_at)
+                for post in posts]
+    return cached_value('stats', f'recent_posts:{limit}', compute)
+def unread_messages_count():
+    if not current_user.is_authenticated:
+        return 0
+    if 'unread_messages_count' not in g:
+        g.unread_messages_count = Message.query.filter_by(recipient_id=current_user.id, is_read=False).count()
+    return g.unread_messages_count
+def invalidate_stats():
+    bump_content_version('stats')
+# Admin user listing
+# The table is sorted and paged in SQL over indexed columns, and activity
+# counts are fetched only for the users on the page, so its cost does not
+# grow with the number of accounts.
+AdminUser = namedtuple('AdminUser', 'id username email join_date is_admin post_count comment_count message_count')
+AdminUserPage = namedtuple('AdminUserPage', 'users page per_page total pages')
+ADMIN_USER_SORTS = {
+    'username': (User.username,),
+    'joined': (User.join_date, User.id),
+    'posts': (User.post_count, User.id),
+}
+def user_activity(user_ids):
+    """Map each of ``user_ids`` to its ``(comments, messages sent)`` counts in one grouped query."""
+    if not user_ids:
+        return {}
+    activity = db.union_all(
+        db.select(Comment.user_id.label('user_id'), db.literal('comments').label('kind')).where(
+            Comment.user_id.in_(user_ids)),
+        db.select(Message.sender_id, db.literal('messages')).where(Message.sender_id.in_(user_ids)),
+    ).subquery()
+    counts = {user_id: [0, 0] for user_id in user_ids}
+    for user_id, kind, count in db.session.execute(
+            db.select(activity.c.user_id, activity.c.kind, db.func.count())
+            .group_by(activity.c.user_id, activity.c.kind)):
+        counts[user_id][kind == 'messages'] = count
+    return counts
+def load_admin_users(page, per_page, query='', admins_only=False, sort='joined', descending=True):
+    filters = []
+    if query:
+        filters.append(db.or_(User.username.startswith(query, autoescape=True),
+                              User.email.startswith(query, autoescape=True)))
+    if admins_only:
+        filters.append(User.is_admin.is_(True))
+    if filters:
+        total = cached_value('stats', f'admin_users:{admins_only}:{query}', lambda: db.session.execute(
+            db.select(db.func.count(User.id)).where(*filters)).scalar())
+    else:
+        total = forum_counts().user_count
+    pages = max((total + per_page - 1) // per_page, 1)
+    page = min(page, pages)
+    order = [column.desc() if descending else column.asc() for column in ADMIN_USER_SORTS[sort]]
+    rows = db.session.execute(
+        db.select(User.id, User.username, User.email, User.join_date, User.is_admin, User.post_count)
+        .where(*filters).order_by(*order).limit(per_page).offset((page - 1) * per_page)).all()
+    activity = user_activity([row.id for row in rows])
+    users = [AdminUser(*row, *activity[row.id]) for row in rows]
+    return AdminUserPage(users, page, per_page, total, pages)
+# Conversation inbox
+InboxUser = namedtuple('InboxUser', 'id username')
+InboxMessage = namedtuple('InboxMessage', 'id content created_at sender_id')
+InboxEntry = namedtuple('InboxEntry', 'user last_message unread_count')
+def load_inbox(user_id, per_page, after=None, before=None):
+    """Return a KeysetPage of ``user_id``'s conversations, most recently active first.
+
+    A single query finds every conversation partner, the last message
+    exchanged with them and the number of their messages still unread, by
+    ranking the user's messages per partner with window functions.
+    """
+    partner_id = db.case((Message.sender_id == user_id, Message.recipient_id), else_=Message.sender_id)
+    unread = db.case((db.and_(Message.recipient_id == user_id, Message.is_read == db.false()), 1), else_=0)
+    ranked = db.select(
+        Message.id, Message.content, Message.created_at, Message.sender_id, partner_id.label('partner_id'),
+        db.func.row_number().over(
+            partition_by=partner_id, order_by=(Message.created_at.desc(), Message.id.desc())).label('position'),
+        db.func.sum(unread).over(partition_by=partner_id).label('unread_count'),
+    ).where(db.or_(Message.sender_id == user_id, Message.recipient_id == user_id)).subquery()
+    inbox = db.select(ranked, User.username).join(User, User.id == ranked.c.partner_id).where(
+        ranked.c.position == 1).subquery()
+    page = keyset_paginate(db.session.query(inbox), inbox.c, per_page, after=after, before=before, descending=True)
+    entries = [InboxEntry(InboxUser(row.partner_id, row.username),
+                          InboxMessage(row.id, row.content, row.created_at, row.sender_id),
+                          row.unread_count)
+               for row in page.items]
+    return page._replace(items=entries)
+def between(user_id, other_id):
+    """Filter matching the messages exchanged by two users, in either direction."""
+    return db.or_(
+        db.and_(Message.sender_id == user_id, Message.recipient_id == other_id),
+        db.and_(Message.sender_id == other_id, Message.recipient_id == user_id))
+def mark_conversation_read(user_id, other_id):
+    """Mark every message ``other_id`` sent to ``user_id`` as read in one UPDATE."""
+    db.session.execute(
+        db.update(Message).where(
+            Message.sender_id == other_id, Message.recipient_id == user_id, Message.is_read == db.false())
+        .values(is_read=True).execution_options(synchronize_session=False))
+    db.session.commit()
+def message_json(message):
+    return {
+        'id': message.id,
+        'content': message.content,
+        'html': str(nl2br(escape(message.content))),
+        'created_at': message.created_at.strftime('%Y-%m-%d %H:%M'),
+        'sender_id': message.sender_id,
+    }
+# Conditional requests
+# index, category and topic answer If-None-Match / If-Modified-Since with a
+# 304 before rendering anything. Their validators are MAX() aggregates that
+# SQLite answers from an index alone; posts and comments are never edited in
+# place, so new rows are the only changes the pages can show. The counters
+# those rows feed are refreshed by a background job; while one for a page's
+# topic or category is unfinished, that page goes out without validators.
+@lru_cache(maxsize=None)
+def code_version():
+    # Changes on every deploy so browsers revalidate pages built by older templates
+    template_dir = os.path.join(current_app.root_path, current_app.template_folder)
+    paths = [__file__] + [os.path.join(root, name) for root, _, names in os.walk(template_dir) for name in names]
+    if assets.manifest:
+        paths.append(assets.manifest_path)
+    stamp = ''.join(f'{path}:{os.path.getmtime(path)}' for path in sorted(paths))
+    return hashlib.sha1(stamp.encode()).hexdigest()[:8]
+def _latest(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+def index_validator():
+    row = db.session.execute(db.select(
+        # Any topic or post refresh changes the category counts shown here
+        jobs.pending('refresh_counters', 'categories'),
+        db.select(db.func.max(User.id)).scalar_subquery(),
+        db.select(db.func.max(Category.id)).scalar_subquery(),
+        db.select(db.func.max(Topic.id)).scalar_subquery(),
+        db.select(db.func.max(Post.id)).scalar_subquery(),
+        db.select(db.func.max(User.join_date)).scalar_subquery(),
+        db.select(db.func.max(Topic.created_at)).scalar_subquery(),
+        db.select(db.func.max(Post.created_at)).scalar_subquery(),
+    )).one()
+    if row[0]:
+        return None, None
+    return row[1:5], _latest(*row[5:])
+def category_validator(category_id):
+    # Every topic starts with a post, so last_post_at also covers new topics
+    row = db.session.execute(db.select(
+        jobs.pending('refresh_counters', 'categories', category_id),
+        db.select(db.func.max(Topic.id)).where(Topic.category_id == category_id).scalar_subquery(),
+        db.select(db.func.max(Topic.last_post_at)).where(Topic.category_id == category_id).scalar_subquery(),
+    )).one()
+    if row[0]:
+        return None, None
+    return tuple(row[1:]), row[2]
+def topic_validator(topic_id):
+    state = thread_state(topic_id)
+    pending, *last_modified = db.session.execute(db.select(
+        jobs.pending('refresh_counters', 'topics', topic_id),
+        db.select(db.func.max(Post.created_at)).where(Post.topic_id == topic_id).scalar_subquery(),
+        db.select(db.func.max(Comment.created_at)).join(Post, Post.id == Comment.post_id)
+        .where(Post.topic_id == topic_id).scalar_subquery(),
+    )).one()
+    if pending:
+        return None, None
+    return (state.last_post_id, state.last_comment_id), _latest(*last_modified)
+def conditional_page(name, state, last_modified, render):
+    """Render a page, or answer 304 if the client's copy is still current.
+
+    ``state`` is the validator tuple; signed-in users also get their id and
+    unread count in the ETag since the navbar shows them. Pages with flashed
+    messages waiting are always rendered in full, as are pages whose
+    validator returned no ``state`` because a counter refresh for them is
+    unfinished: they go out without an ETag or Last-Modified, so a copy with
+    stale counts is never revalidated with a 304.
+    """
+    if '_flashes' in session or state is None:
+        return render()
+    viewer = (current_user.id, unread_messages_count()) if current_user.is_authenticated else ()
+    etag = hashlib.sha1(repr((code_version(), name, request.full_path, state, viewer)).encode()).hexdigest()[:20]
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    if current_user.is_authenticated:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = 0
+        response.cache_control.s_maxage = current_app.config['PUBLIC_CACHE_MAX_AGE']
+        response.vary.add('Cookie')
+    return response
+# Streaming pages
+# topic, profile, search and conversation stream their HTML. The views run
+# every query that can reject the request (such as a bad cursor) before the
+# stream starts, so those still get a proper status; only search leaves its
+# query to the template, through load_results.
+def _coalesce(chunks, size):
+    buffer, length = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+def stream_page(template_name, **context):
+    # The session cookie goes out with the headers, so anything that changes
+    # the session (popping flashes, Flask-Login's checks) has to happen first
+    get_flashed_messages()
+    current_user._get_current_object()
+    chunks = stream_template(template_name, **context)
+    return current_app.response_class(_coalesce(chunks, current_app.config['STREAM_CHUNK_SIZE']), mimetype='text/html')
+# Signed-in identity
+# The layout only needs the signed-in user's id, name and admin flag, so
+# requests get a CurrentUser snapshot from the cache instead of a User row.
+# Routes that need the row call current_user.load(); whatever changes a
+# user's name or admin flag calls forget_identity().
+class CurrentUser:
+    __slots__ = ('id', 'username', 'is_admin', '_user')
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+    def __init__(self, id, username, is_admin):
+        self.id = id
+        self.username = username
+        self.is_admin = is_admin
+        self._user = None
+    def get_id(self):
+        return str(self.id)
+    def __eq__(self, other):
+        # Same account as a User row or another snapshot, as with UserMixin
+        get_id = getattr(other, 'get_id', None)
+        if get_id is None:
+            return NotImplemented
+        return self.get_id() == get_id()
+    def __hash__(self):
+        return hash(self.get_id())
+    def load(self):
+        """The full User row, loaded on first use."""
+        if self._user is None:
+            self._user = db.session.get(User, self.id)
+        return self._user
+def forget_identity(user_id):
+    cache.delete(f'identity:{user_id}')
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    key = f'identity:{user_id}'
+    identity = cache.get(key)
+    if identity is None:
+        row = db.session.execute(
+            db.select(User.id, User.username, User.is_admin).where(User.id == int(user_id))).first()
+        if row is None:
+            return None
+        identity = tuple(row)
+        cache.set(key, identity, timeout=current_app.config['IDENTITY_CACHE_TIMEOUT'])
+    return CurrentUser(*identity)
 # Routes
-@app.route('/')
+@bp.route('/')
 def index():
-    categories = Category.query.all()
-    topic_count = Topic.query.count()
-    user_count = User.query.count()
-    return render_template('index.html', categories=categories, topic_count=topic_count, user_count=user_count)
-@app.route('/register', methods=['GET', 'POST'])
+    def render_index():
+        categories = Category.query.all()
+        counts = forum_counts()
+        return render_template('index.html', categories=categories, topic_count=counts.topic_count,
+                               user_count=counts.user_count)
+    return conditional_page('index', *index_validator(), render_index)
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     if request.method == 'POST':
         username = request.form.get('username')
         email = request.form.get('email')
         password = request.form.get('password')
-        user_exists = User.query.filter_by(username=username).first()
-        email_exists = User.query.filter_by(email=email).first()
-        if user_exists:
+        taken = db.session.execute(db.select(User.username, User.email).where(
+            db.or_(User.username == username, User.email == email))).all()
+        if any(row.username == username for row in taken):
             flash('Username already exists.')
-            return redirect(url_for('register'))
-        if email_exists:
+            return redirect(url_for('main.register'))
+        if taken:
             flash('Email already exists.')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
         new_user = User(username=username, email=email)
         new_user.set_password(password)
         db.session.add(new_user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Someone registered the same name or email since the check above
+            db.session.rollback()
+            flash('Username or email already exists.')
+            return redirect(url_for('main.register'))
+        invalidate_stats()
         flash('Registration successful! Please log in.')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('register.html')
-@app.route('/login', methods=['GET', 'POST'])
+def login_username_key():
+    return 'login:' + (request.form.get('username') or '').strip().lower()
+@bp.route('/login', methods=['GET', 'POST'])
+@limiter.limit(lambda: current_app.config['LOGIN_LIMIT_PER_IP'], methods=['POST'])
+@limiter.limit(lambda: current_app.config['LOGIN_LIMIT_PER_USERNAME'], key_func=login_username_key, methods=['POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
         user = User.query.filter_by(username=username).first()
         if user and user.check_password(password):
+            db.session.commit()
             login_user(user)
             next_page = request.args.get('next')
-            return redirect(next_page or url_for('index'))
+            return redirect(next_page or url_for('main.index'))
         flash('Invalid username or password')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('login.html')
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('index'))
-@app.route('/profile/<username>')
+    return redirect(url_for('main.index'))
+@bp.route('/profile/<username>')
 def profile(username):
     user = User.query.filter_by(username=username).first_or_404()
-    posts = Post.query.filter_by(user_id=user.id).order_by(Post.created_at.desc()).all()
-    return render_template('profile.html', user=user, posts=posts)
-@app.route('/profile/edit', methods=['GET', 'POST'])
+    posts = keyset_paginate(
+        Post.query.filter_by(user_id=user.id).options(db.joinedload(Post.topic).joinedload(Topic.category)),
+        Post, current_app.config['POSTS_PER_PAGE'], after=request.args.get('after'),
+        before=request.args.get('before'), descending=True)
+    return stream_page('profile.html', user=user, posts=posts)
+@bp.route('/profile/edit', methods=['GET', 'POST'])
 @login_required
 def edit_profile():
+    user = current_user.load()
     if request.method == 'POST':
         bio = request.form.get('bio')
-        current_user.bio = bio
+        user.bio = bio
         # Check if password change was requested
         current_password = request.form.get('current_password')
         new_password = request.form.get('new_password')
         confirm_password = request.form.get('confirm_password')
         if current_password and new_password and confirm_password:
-            if not current_user.check_password(current_password):
+            if not user.check_password(current_password):
                 flash('Current password is incorrect.')
-                return redirect(url_for('edit_profile'))
+                return redirect(url_for('main.edit_profile'))
             if new_password != confirm_password:
                 flash('New passwords do not match.')
-                return redirect(url_for('edit_profile'))
-            current_user.set_password(new_password)
+                return redirect(url_for('main.edit_profile'))
+            user.set_password(new_password)
             flash('Password updated successfully.')
         db.session.commit()
+        forget_identity(user.id)
         flash('Profile updated successfully.')
-        return redirect(url_for('profile', username=current_user.username))
-    return render_template('edit_profile.html')
-@app.route('/category/<int:category_id>')
-@app.route('/category/<int:category_id>/page/<int:page>')
-@cache.cached(timeout=60, query_string=True)
+        return redirect(url_for('main.profile', username=user.username))
+    return render_template('edit_profile.html', user=user)
+@bp.route('/category/<int:category_id>')
+@bp.route('/category/<int:category_id>/page/<int:page>')
 def category(category_id, page=1):
     category = Category.query.get_or_404(category_id)
-    topics = Topic.query.filter_by(category_id=category_id).order_by(Topic.created_at.desc()).paginate(
-        page=page, per_page=app.config['TOPICS_PER_PAGE'], error_out=False)
-    return render_template('category.html', category=category, topics=topics)
-@app.route('/topic/new/<int:category_id>', methods=['GET', 'POST'])
+    paging = page_request(page)
+    if paging is None:
+        return redirect(url_for('main.category', category_id=category_id))
+    after, before, page = paging
+    def render_topic_list():
+        topics = keyset_paginate(
+            Topic.query.filter_by(category_id=category_id).options(db.joinedload(Topic.first_post_author)),
+            Topic, current_app.config['TOPICS_PER_PAGE'], after=after, before=before, page=page, descending=True)
+        return render_template('fragments/topic_list.html', category=category, topics=topics)
+    def render_category():
+        topic_list_html = cached_fragment(f'category:{category_id}', f'page:{page}:{after}:{before}', render_topic_list)
+        return render_template('category.html', category=category, topic_list_html=topic_list_html)
+    return conditional_page('category', *category_validator(category_id), render_category)
+@bp.route('/topic/new/<int:category_id>', methods=['GET', 'POST'])
 @login_required
 def new_topic(category_id):
     category = Category.query.get_or_404(category_id)
@@ -242,24 +1047,47 @@ def new_topic(category_id):
         content = request.form.get('content')
         if not title or not content:
             flash('Title and content are required.')
-            return redirect(url_for('new_topic', category_id=category_id))
+            return redirect(url_for('main.new_topic', category_id=category_id))
         topic = Topic(title=title, description=description, category_id=category_id)
-        db.session.add(topic)
-        db.session.commit()
-        post = Post(content=content, user_id=current_user.id, topic_id=topic.id)
+        post = Post(**content_columns(content), user_id=current_user.id, topic=topic)
         db.session.add(post)
+        db.session.flush()
+        refresh_counters_later(topic, post)
         db.session.commit()
-        return redirect(url_for('topic', topic_id=topic.id))
+        bump_content_version(f'category:{category_id}')
+        return redirect(url_for('main.topic', topic_id=topic.id))
     return render_template('new_topic.html', category=category)
-@app.route('/topic/<int:topic_id>')
-@app.route('/topic/<int:topic_id>/page/<int:page>')
-@cache.cached(timeout=30, query_string=True)
+@bp.route('/topic/<int:topic_id>')
+@bp.route('/topic/<int:topic_id>/page/<int:page>')
 def topic(topic_id, page=1):
-    topic = Topic.query.get_or_404(topic_id)
-    posts = Post.query.filter_by(topic_id=topic_id).order_by(Post.created_at).paginate(
-        page=page, per_page=app.config['POSTS_PER_PAGE'], error_out=False)
-    return render_template('topic.html', topic=topic, posts=posts)
-@app.route('/post/new/<int:topic_id>', methods=['GET', 'POST'])
+    topic = Topic.query.options(db.joinedload(Topic.category)).filter_by(id=topic_id).first_or_404()
+    paging = page_request(page)
+    if paging is None:
+        return redirect(url_for('main.topic', topic_id=topic_id))
+    after, before, page = paging
+    def render_thread():
+        thread = load_thread_page(topic, current_app.config['POSTS_PER_PAGE'], after=after, before=before, page=page)
+        return render_template('fragments/thread.html', topic=topic, posts=thread.pagination, thread_posts=thread.posts)
+    def render_topic():
+        thread_html = cached_fragment(f'topic:{topic_id}', f'page:{page}:{after}:{before}', render_thread)
+        return stream_page('topic.html', topic=topic, thread_html=thread_html)
+    return conditional_page('topic', *topic_validator(topic_id), render_topic)
+def create_post(topic, content):
+    post = Post(**content_columns(content), user_id=current_user.id, topic_id=topic.id)
+    db.session.add(post)
+    db.session.flush()
+    refresh_counters_later(topic, post)
+    db.session.commit()
+    bump_content_version(f'topic:{topic.id}', f'category:{topic.category_id}')
+    return post
+def create_comment(post, content):
+    comment = Comment(**content_columns(content), user_id=current_user.id, post_id=post.id)
+    db.session.add(comment)
+    jobs.enqueue('refresh_counters', {'posts': [post.id]})
+    db.session.commit()
+    bump_content_version(f'topic:{post.topic_id}')
+    return comment
+@bp.route('/post/new/<int:topic_id>', methods=['GET', 'POST'])
 @login_required
 def new_post(topic_id):
     topic = Topic.query.get_or_404(topic_id)
@@ -269,23 +1097,19 @@ def new_post(topic_id):
         content = request.form.get('content')
         if not content:
             flash('Content is required.')
-            return redirect(url_for('new_post', topic_id=topic_id))
-        post = Post(content=content, user_id=current_user.id, topic_id=topic_id)
-        db.session.add(post)
-        db.session.commit()
-        return redirect(url_for('topic', topic_id=topic_id))
+            return redirect(url_for('main.new_post', topic_id=topic_id))
+        create_post(topic, content)
+        return redirect(url_for('main.topic', topic_id=topic_id))
     return render_template('new_post.html', topic=topic)
-@app.route('/comment/new/<int:post_id>', methods=['POST'])
+@bp.route('/comment/new/<int:post_id>', methods=['POST'])
 @login_required
 def new_comment(post_id):
     post = Post.query.get_or_404(post_id)
     content = request.form.get('content')
     if not content:
         flash('Comment content is required.')
-        return redirect(url_for('topic', topic_id=post.topic_id))
-    comment = Comment(content=content, user_id=current_user.id, post_id=post_id)
-    db.session.add(comment)
-    db.session.commit()
+        return redirect(url_for('main.topic', topic_id=post.topic_id))
+    comment = create_comment(post, content)
 
     # Check if request is AJAX
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -294,113 +1118,188 @@ def new_comment(post_id):
             'id': comment.id,
             'content': comment.content,
             'created_at': comment.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'time_since': app.jinja_env.filters['time_since'](comment.created_at),
+            'time_since': time_since(comment.created_at),
             'author': {
                 'id': current_user.id,
                 'username': current_user.username,
-                'profile_url': url_for('profile', username=current_user.username)
+                'profile_url': url_for('main.profile', username=current_user.username)
             },
-            'formatted_content': app.jinja_env.filters['format_content'](comment.content)
+            'formatted_content': comment.content_html
         }
 
     # Return normal redirect for non-AJAX requests
-    return redirect(url_for('topic', topic_id=post.topic_id))
-@app.route('/search')
+    return redirect(url_for('main.topic', topic_id=post.topic_id))
+# Thread API
+# JSON endpoints behind the live topic page. Polling clients send the ETag of
+# their last response back in If-None-Match and get a bodiless 304 while the
+# thread is unchanged; the check costs one index-only query.
+def api_error(message, status):
+    return {'error': message}, status
+def api_content():
+    data = request.get_json(silent=True) or request.form
+    return (data.get('content') or '').strip()
+@bp.route('/api/topics/<int:topic_id>/posts')
+def api_topic_posts(topic_id):
+    since = request.args.get('since', 0, type=int)
+    state = thread_state(topic_id)
+    if state.topic_id is None:
+        return api_error('Topic not found.', 404)
+    etag = f'{topic_id}-{state.last_post_id or 0}-{state.last_comment_id or 0}'
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        posts = load_posts_since(topic_id, since, current_app.config['API_BATCH_SIZE'])
+        response = jsonify({
+            'posts': [post_json(post) for post in posts],
+            'last_post_id': state.last_post_id,
+            'last_comment_id': state.last_comment_id,
+        })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+@bp.route('/api/topics/<int:topic_id>/posts', methods=['POST'])
+def api_create_post(topic_id):
+    if not current_user.is_authenticated:
+        return api_error('Login required.', 401)
+    topic = db.session.get(Topic, topic_id)
+    if topic is None:
+        return api_error('Topic not found.', 404)
+    content = api_content()
+    if not content:
+        return api_error('Content is required.', 400)
+    post = create_post(topic, content)
+    return post_json(thread_posts([post])[0]), 201
+@bp.route('/api/comments')
+def api_comments():
+    post_ids = request.args.getlist('post_id', type=int)
+    if len(post_ids) > current_app.config['API_BATCH_SIZE']:
+        return api_error(f'At most {current_app.config["API_BATCH_SIZE"]} post ids per request.', 400)
+    since = request.args.get('since', 0, type=int)
+    comments_by_post = load_comments(post_ids, since=since)
+    return {'comments': {str(post_id): [comment_json(comment) for comment in comments]
+                         for post_id, comments in comments_by_post.items()}}
+@bp.route('/api/posts/<int:post_id>/comments', methods=['POST'])
+def api_create_comment(post_id):
+    if not current_user.is_authenticated:
+        return api_error('Login required.', 401)
+    post = db.session.get(Post, post_id)
+    if post is None:
+        return api_error('Post not found.', 404)
+    content = api_content()
+    if not content:
+        return api_error('Content is required.', 400)
+    comment = create_comment(post, content)
+    return comment_json(ThreadComment(comment.id, comment.content, Markup(comment.content_html),
+                                      comment.created_at, _author_view(current_user.load()))), 201
+@bp.route('/search')
 def search():
     query = request.args.get('query', '')
-    if not query:
-        return render_template('search.html', results=None)
-    topics = Topic.query.filter(Topic.title.contains(query)).all()
-    posts = Post.query.filter(Post.content.contains(query)).all()
-    return render_template('search.html', query=query, topics=topics, posts=posts)
+    page = max(request.args.get('page', 1, type=int), 1)
+    def load_results():
+        return search_forum(query, page, current_app.config['SEARCH_RESULTS_PER_PAGE'])
+    return stream_page('search.html', query=query, load_results=load_results)
 # Admin routes
-@app.route('/admin')
+@bp.route('/admin')
 @login_required
 def admin():
     if not current_user.is_admin:
         flash('You do not have permission to access this page.')
-        return redirect(url_for('index'))
-    users = User.query.all()
-    categories = Category.query.all()
-    topic_count = Topic.query.count()
-    post_count = Post.query.count()
-    return render_template('admin.html', users=users, categories=categories, topic_count=topic_count, post_count=post_count)
-@app.route('/admin/category/new', methods=['GET', 'POST'])
+        return redirect(url_for('main.index'))
+    query = request.args.get('q', '').strip()
+    admins_only = request.args.get('role') == 'admin'
+    sort = request.args.get('sort', 'joined')
+    if sort not in ADMIN_USER_SORTS:
+        sort = 'joined'
+    descending = request.args.get('order', 'asc' if sort == 'username' else 'desc') == 'desc'
+    page = max(request.args.get('page', 1, type=int), 1)
+    users = load_admin_users(page, current_app.config['ADMIN_USERS_PER_PAGE'], query, admins_only, sort, descending)
+    categories = Category.query.order_by(Category.name).all()
+    return render_template('admin.html', users=users, categories=categories, counts=forum_counts(), query=query,
+                           admins_only=admins_only, sort=sort, descending=descending)
+@bp.route('/admin/cache-stats')
+@login_required
+def cache_stats():
+    if not current_user.is_admin:
+        abort(403)
+    backend = cache.cache
+    return {
+        'backend': current_app.config['CACHE_TYPE'],
+        'stats': backend.stats() if hasattr(backend, 'stats') else None
+    }
+@bp.route('/admin/jobs')
+@login_required
+def job_metrics():
+    if not current_user.is_admin:
+        abort(403)
+    return jobs.metrics()
+@bp.route('/admin/profiling', methods=['GET', 'POST'])
+@login_required
+def admin_profiling():
+    if not current_user.is_admin:
+        abort(403)
+    if request.method == 'POST':
+        profiler.reset()
+        flash('Profiling statistics cleared.')
+        return redirect(url_for('main.admin_profiling'))
+    limit = request.args.get('limit', current_app.config['PROFILING_TOP_N'], type=int)
+    return render_template('admin_profiling.html', enabled=profiler.enabled, endpoints=profiler.slowest(limit),
+                           query_budget=current_app.config['PROFILING_QUERY_BUDGET'])
+@bp.route('/admin/category/new', methods=['GET', 'POST'])
 @login_required
 def new_category():
     if not current_user.is_admin:
         flash('You do not have permission to access this page.')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     if request.method == 'POST':
         name = request.form.get('name')
         description = request.form.get('description')
         if not name:
             flash('Category name is required.')
-            return redirect(url_for('new_category'))
+            return redirect(url_for('main.new_category'))
         category = Category(name=name, description=description)
         db.session.add(category)
         db.session.commit()
+        invalidate_stats()
         flash('Category created successfully.')
-        return redirect(url_for('admin'))
+        return redirect(url_for('main.admin'))
     return render_template('new_category.html')
 # Initialize the database
-with app.app_context():
+# Run by flask forum init-db rather than at import, so starting a worker
+# touches neither the schema nor the seed rows
+def init_db():
+    """Create or upgrade the schema, and seed a new database with the admin
+    account and the starter categories. Returns whether it seeded."""
     db.create_all()
+    jobs.create_table()
+    if upgrade_schema():
+        rebuild_counters()
+    ensure_search_index()
     # Create admin user if it doesn't exist
-    admin = User.query.filter_by(username='admin').first()
-    if not admin:
-        admin = User(username='admin', email='admin@example.com', is_admin=True)
-        admin.set_password('admin')
-        db.session.add(admin)
-        # Create some initial categories
-        categories = [
-            Category(name='General Discussion', description='General topics related to development'),
-            Category(name='Web Development', description='Discussions about web technologies'),
-            Category(name='Mobile Development', description='Topics related to mobile app development'),
-            Category(name='Data Science', description='Discussions about data science and machine learning'),
-            Category(name='DevOps', description='Topics related to DevOps practices')
-        ]
-        db.session.add_all(categories)
-        db.session.commit()
+    if User.query.filter_by(username='admin').first():
+        return False
+    admin = User(username='admin', email='admin@example.com', is_admin=True)
+    admin.set_password('admin')
+    db.session.add(admin)
+    # Create some initial categories
+    categories = [
+        Category(name='General Discussion', description='General topics related to development'),
+        Category(name='Web Development', description='Discussions about web technologies'),
+        Category(name='Mobile Development', description='Topics related to mobile app development'),
+        Category(name='Data Science', description='Discussions about data science and machine learning'),
+        Category(name='DevOps', description='Topics related to DevOps practices')
+    ]
+    db.session.add_all(categories)
+    db.session.commit()
+    return True
 # Chat routes
-@app.route('/messages')
+@bp.route('/messages')
 @login_required
 def messages():
-    # Get all users that the current user has conversations with
-    sent_to_users = db.session.query(User).join(Message, User.id == Message.recipient_id).filter(Message.sender_id == current_user.id).distinct().all()
-    received_from_users = db.session.query(User).join(Message, User.id == Message.sender_id).filter(Message.recipient_id == current_user.id).distinct().all()
-
-    # Combine the lists and remove duplicates
-    conversation_users = list(set(sent_to_users + received_from_users))
-
-    # Get the last message for each conversation
-    conversations = []
-    for user in conversation_users:
-        # Get the last message between the current user and this user
-        last_message = Message.query.filter(
-            ((Message.sender_id == current_user.id) & (Message.recipient_id == user.id)) |
-            ((Message.sender_id == user.id) & (Message.recipient_id == current_user.id))
-        ).order_by(Message.created_at.desc()).first()
-
-        # Count unread messages
-        unread_count = Message.query.filter_by(
-            sender_id=user.id, 
-            recipient_id=current_user.id, 
-            is_read=False
-        ).count()
-
-        conversations.append({
-            'user': user,
-            'last_message': last_message,
-            'unread_count': unread_count
-        })
+    inbox = load_inbox(current_user.id, current_app.config['CONVERSATIONS_PER_PAGE'],
+                       after=request.args.get('after'), before=request.args.get('before'))
+    return render_template('messages.html', conversations=inbox.items, inbox=inbox)
 
-    # Sort conversations by the timestamp of the last message
-    conversations.sort(key=lambda x: x['last_message'].created_at if x['last_message'] else datetime.min, reverse=True)
-
-    return render_template('messages.html', conversations=conversations)
-
-@app.route('/messages/<username>', methods=['GET', 'POST'])
+@bp.route('/messages/<username>', methods=['GET', 'POST'])
 @login_required
 def conversation(username):
     user = User.query.filter_by(username=username).first_or_404()
@@ -416,29 +1315,29 @@ def conversation(username):
             db.session.add(message)
             db.session.commit()
             flash('Message sent.')
-            return redirect(url_for('conversation', username=username))
+            return redirect(url_for('main.conversation', username=username))
 
-    # Get all messages between the current user and the other user
-    messages = Message.query.filter(
-        ((Message.sender_id == current_user.id) & (Message.recipient_id == user.id)) |
-        ((Message.sender_id == user.id) & (Message.recipient_id == current_user.id))
-    ).order_by(Message.created_at).all()
+    # Mark first: the commit would otherwise expire the loaded messages
+    mark_conversation_read(current_user.id, user.id)
 
-    # Mark unread messages as read
-    unread_messages = Message.query.filter_by(
-        sender_id=user.id, 
-        recipient_id=current_user.id, 
-        is_read=False
-    ).all()
+    # Only the most recent window of messages; older ones are reached through the cursor
+    window = keyset_paginate(
+        Message.query.filter(between(current_user.id, user.id)), Message, current_app.config['MESSAGES_PER_PAGE'],
+        after=request.args.get('after'), before=request.args.get('before'), descending=True)
 
-    for message in unread_messages:
-        message.is_read = True
+    return stream_page('conversation.html', user=user, messages=window.items[::-1], window=window)
 
-    db.session.commit()
-
-    return render_template('conversation.html', user=user, messages=messages)
+@bp.route('/messages/<username>/since/<int:message_id>')
+@login_required
+def conversation_since(username, message_id):
+    user = User.query.filter_by(username=username).first_or_404()
+    messages = Message.query.filter(between(current_user.id, user.id), Message.id > message_id).order_by(
+        Message.id).limit(current_app.config['MESSAGES_PER_PAGE']).all()
+    if any(message.recipient_id == current_user.id and not message.is_read for message in messages):
+        mark_conversation_read(current_user.id, user.id)
+    return {'messages': [message_json(message) for message in messages]}
 
-@app.route('/messages/new/<username>', methods=['GET', 'POST'])
+@bp.route('/messages/new/<username>', methods=['GET', 'POST'])
 @login_required
 def new_message(username):
     user = User.query.filter_by(username=username).first_or_404()
@@ -454,48 +1353,220 @@ def new_message(username):
             db.session.add(message)
             db.session.commit()
             flash('Message sent.')
-            return redirect(url_for('conversation', username=username))
+            return redirect(url_for('main.conversation', username=username))
 
     return render_template('new_message.html', user=user)
 
 # Error handlers
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def page_not_found(e):
     return render_template('errors/404.html'), 404
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def internal_server_error(e):
     db.session.rollback()  # Roll back the session in case of database errors
     return render_template('errors/500.html'), 500
-@app.errorhandler(403)
+@bp.app_errorhandler(403)
 def forbidden(e):
     return render_template('errors/403.html'), 403
+@bp.app_errorhandler(429)
+def too_many_requests(e):
+    return render_template('errors/429.html'), 429
+@bp.app_errorhandler(CredentialServiceBusy)
+def credential_service_busy(e):
+    db.session.rollback()
+    return render_template('errors/503.html'), 503, {'Retry-After': '5'}
 # Context processors
-@app.context_processor
+@bp.app_context_processor
 def utility_processor():
-    def recent_topics(limit=5):
-        return Topic.query.order_by(Topic.created_at.desc()).limit(limit).all()
-    def recent_posts(limit=5):
-        return Post.query.order_by(Post.created_at.desc()).limit(limit).all()
-    def user_count():
-        return User.query.count()
-    def topic_count():
-        return Topic.query.count()
-    def post_count():
-        return Post.query.count()
-    def unread_messages_count():
-        if current_user.is_authenticated:
-            return Message.query.filter_by(
-                recipient_id=current_user.id,
-                is_read=False
-            ).count()
-        return 0
     return {
         'recent_topics': recent_topics,
         'recent_posts': recent_posts,
-        'user_count': user_count,
-        'topic_count': topic_count,
-        'post_count': post_count,
+        'user_count': lambda: forum_counts().user_count,
+        'topic_count': lambda: forum_counts().topic_count,
+        'post_count': lambda: forum_counts().post_count,
         'unread_messages_count': unread_messages_count
     }
+# Import / export
+# flask forum export/import move the forum between databases as NDJSON (see
+# data_transfer.py). Counters and rendered HTML are derived from other rows,
+# so exports leave them out and imports rebuild them once at the end.
+TRANSFER_MODELS = [User, Category, Topic, Post, Comment, Message]
+TRANSFER_DERIVED = {'post_count', 'topic_count', 'comment_count', 'last_post_at', 'first_post_author_id',
+                    'content_html', 'content_html_version'}
+def transfer_tables():
+    return [(model.__table__, [column for column in model.__table__.columns if column.name not in TRANSFER_DERIVED])
+            for model in TRANSFER_MODELS]
+def _with_html(row):
+    row.update(content_columns(row['content']))
+    return row
+def drop_secondary_indexes():
+    """Drop the indexes and search triggers so bulk inserts skip them;
+    upgrade_schema and rebuild_search_index put them back."""
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(conn, checkfirst=True)
+        if search_index_enabled():
+            triggers = conn.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'search_%'").scalars().all()
+            for name in triggers:
+                conn.exec_driver_sql(f'DROP TRIGGER "{name}"')
+# CLI commands
+forum_cli = AppGroup('forum', help='Forum maintenance commands.')
+@forum_cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the tables, indexes and search index, seeding a new database."""
+    if init_db():
+        click.echo('Created the admin account (password "admin") and the starter categories.')
+    click.echo('The database is ready.')
+@forum_cli.command('rebuild-counters')
+def rebuild_counters_command():
+    """Recompute the denormalized counters from the existing rows."""
+    upgrade_schema()
+    rebuild_counters()
+    click.echo('Counters rebuilt.')
+@forum_cli.command('retry-jobs')
+def retry_jobs_command():
+    """Queue the background jobs that ran out of attempts to run again."""
+    click.echo(f'{jobs.retry_failed()} failed jobs queued again.')
+@forum_cli.command('rebuild-search')
+def rebuild_search_command():
+    """Re-index every topic, post and comment for full-text search."""
+    if not search_index_enabled():
+        raise click.ClickException('Full-text search needs an SQLite database with FTS5.')
+    rebuild_search_index()
+    click.echo('Search index rebuilt.')
+@forum_cli.command('render-content')
+@click.option('--batch-size', default=1000, show_default=True)
+def render_content_command(batch_size):
+    """Pre-render the HTML of posts and comments that are missing or outdated."""
+    total = 0
+    for model in (Post, Comment):
+        outdated = db.or_(model.content_html_version.is_(None), model.content_html_version != RENDERER_VERSION)
+        while True:
+            rows = model.query.filter(outdated).order_by(model.id).limit(batch_size).all()
+            if not rows:
+                break
+            persist_html(rows)
+            total += len(rows)
+    click.echo(f'Rendered {total} posts and comments.')
+@forum_cli.command('build-assets')
+def build_assets_command():
+    """Minify, fingerprint and precompress the CSS and JavaScript under static/."""
+    from assets import build_assets
+    manifest = build_assets(current_app.static_folder)
+    for source, built in sorted(manifest.items()):
+        click.echo(f'{source} -> {built}')
+    click.echo('Restart the app to serve the new files.')
+def _echo_progress(table, count):
+    click.echo(f'{table}: {count}', err=True)
+@forum_cli.command('export')
+@click.argument('path')
+@click.option('--batch-size', default=5000, show_default=True)
+def export_command(path, batch_size):
+    """Write users, categories, topics, posts, comments and messages to PATH.
+
+    PATH gets one JSON object per line, gzipped when it ends in .gz; - writes
+    to stdout.
+    """
+    from data_transfer import export_tables, open_stream
+    with db.engine.connect() as conn, open_stream(path, 'w') as out:
+        if conn.dialect.name == 'sqlite':
+            # One read transaction keeps every table on the same snapshot
+            conn.exec_driver_sql('BEGIN')
+        else:
+            conn = conn.execution_options(isolation_level='REPEATABLE READ')
+        counts = export_tables(conn, transfer_tables(), out, batch_size, _echo_progress)
+    click.echo('Exported ' + ', '.join(f'{count} {table}' for table, count in counts.items()) + '.', err=True)
+@forum_cli.command('import')
+@click.argument('path')
+@click.option('--batch-size', default=5000, show_default=True)
+@click.option('--restart', is_flag=True, help='Start over instead of resuming an unfinished import.')
+@click.option('--yes', is_flag=True, help='Replace the existing forum data without asking.')
+def import_command(path, batch_size, restart, yes):
+    """Replace the forum's data with an export made by flask forum export.
+
+    An interrupted import resumes from its last checkpoint when run again
+    with the same file.
+    """
+    from data_transfer import TransferError, finish_import, import_tables, open_stream, read_header, start_point
+    with open_stream(path) as stream:
+        try:
+            header = read_header(stream)
+            skip = start_point(db.engine, header, restart)
+            if skip is None and not yes:
+                click.confirm(f'This deletes every user, topic, post and message in {db.engine.url}. Continue?',
+                              abort=True)
+            elif skip:
+                click.echo(f'Resuming after line {skip + 1}.', err=True)
+            drop_secondary_indexes()
+            counts = import_tables(db.engine, stream, header, transfer_tables(), skip, batch_size,
+                                   {'post': _with_html, 'comment': _with_html}, _echo_progress)
+        except TransferError as e:
+            raise click.ClickException(str(e))
+    click.echo('Rebuilding indexes, counters and the search index...', err=True)
+    upgrade_schema()
+    rebuild_counters()
+    if search_index_enabled():
+        rebuild_search_index()
+    finish_import(db.engine)
+    cache.clear()
+    click.echo('Imported ' + ', '.join(f'{count} {table}' for table, count in counts.items()) + '.')
+# Application factory
+def secret_key_file(app):
+    """The key in instance/secret_key, created on first use. Workers started
+    from the same instance folder all read the same key."""
+    path = os.path.join(app.instance_path, 'secret_key')
+    if not os.path.exists(path):
+        os.makedirs(app.instance_path, exist_ok=True)
+        staging = f'{path}.{uuid4().hex}'
+        with open(os.open(staging, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as f:
+            f.write(secrets.token_hex(32))
+        try:
+            # Linking fails if another worker got there first; its key wins
+            os.link(staging, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(staging)
+    with open(path) as f:
+        return f.read().strip()
+def create_app(config=None):
+    """Build the forum app from the environment; ``config`` overrides individual settings.
+
+    Nothing here touches the database, so workers start quickly and the app
+    can be built before a server forks. Run flask forum init-db to create or
+    upgrade the schema.
+    """
+    app = Flask(__name__)
+    configure(app)
+    if config:
+        app.config.update(config)
+    if not app.config['SECRET_KEY']:
+        app.config['SECRET_KEY'] = secret_key_file(app)
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if (url.get_backend_name() == 'sqlite' and not is_file_database(url)
+            and 'SQLALCHEMY_ENGINE_OPTIONS' not in (config or {})):
+        # An in-memory database lives on a single shared connection (StaticPool),
+        # which takes none of the pool sizing options
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {}
+    db.init_app(app)
+    with app.app_context():
+        if is_file_database(db.engine.url):
+            tune_engine(db.engine, app.config['SQLITE_PRAGMAS'])
+    login_manager.init_app(app)
+    cache.init_app(app)
+    limiter.init_app(app)
+    profiler.init_app(app)
+    credentials.init_app(app)
+    jobs.init_app(app, db)
+    compress.init_app(app)
+    app.register_blueprint(bp)
+    assets.init_app(app)
+    app.cli.add_command(forum_cli)
+    return app
 if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        init_db()
     app.run(debug=True)
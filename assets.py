@@ -0,0 +1,159 @@
+"""Fingerprinted, precompressed static assets.
+
+``build_assets`` copies the app's own CSS and JavaScript into
+``static/dist/``. Each file is minified and renamed after a hash of its
+content (``css/style.css`` -> ``dist/css/style.1a2b3c4d5e.css``), and
+written next to ``.gz`` and, when the optional ``brotli`` package is
+installed, ``.br`` variants. ``manifest.json`` maps each source name to its
+built name.
+
+``Assets`` reads that manifest at startup, rewrites
+``url_for('static', filename=...)`` to the built names and serves the
+hashed files with a year-long ``immutable`` ``Cache-Control``; anything else
+under ``dist/``, such as the manifest, is served like any static file. It sends the
+precompressed variant the client prefers. A rebuilt file gets a new name,
+so browsers never have to revalidate one. Without a manifest, or for a
+source edited after the last build, the plain file is served as before.
+
+Minification is deliberately conservative, as there is no CSS or JS parser
+here. It removes comments, blank lines and indentation, and for CSS also
+the whitespace around braces, semicolons, commas and ``>``.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+logger = logging.getLogger(__name__)
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+YEAR = 365 * 24 * 3600
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+_CSS_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+_CSS_SPACE = re.compile(r'\s*([{};,>])\s*')
+_JS_LINE_COMMENT = re.compile(r'^\s*//.*$', re.MULTILINE)
+_FINGERPRINTED = re.compile(r'\.[0-9a-f]{10}\.[a-z]+$')
+
+
+def minify_css(source):
+    source = _CSS_COMMENT.sub('', source)
+    source = _CSS_SPACE.sub(r'\1', ' '.join(source.split()))
+    return source.replace(';}', '}').strip() + '\n'
+
+
+def minify_js(source):
+    # Only whole-line comments: a // inside a line may be part of a string or URL
+    source = _JS_LINE_COMMENT.sub('', source)
+    return '\n'.join(line.strip() for line in source.splitlines() if line.strip()) + '\n'
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def build_assets(static_folder):
+    """Build every CSS and JS file under ``static_folder``; returns the manifest."""
+    dist = os.path.join(static_folder, DIST)
+    manifest = {}
+    for root, dirs, names in os.walk(static_folder):
+        if os.path.abspath(root) == os.path.abspath(static_folder) and DIST in dirs:
+            dirs.remove(DIST)
+        for name in sorted(names):
+            stem, ext = os.path.splitext(name)
+            if ext not in MINIFIERS:
+                continue
+            path = os.path.join(root, name)
+            source = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            with open(path, encoding='utf-8') as f:
+                data = MINIFIERS[ext](f.read()).encode('utf-8')
+            digest = hashlib.sha256(data).hexdigest()[:10]
+            built = posixpath.join(DIST, posixpath.dirname(source), f'{stem}.{digest}{ext}')
+            target = os.path.join(static_folder, built)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            _write(target, data)
+            _write(target + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _write(target + '.br', brotli.compress(data, quality=11))
+            manifest[source] = built
+    os.makedirs(dist, exist_ok=True)
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+class Assets:
+    """Flask extension pointing ``url_for('static')`` at built assets."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_FINGERPRINT', True)
+        app.extensions['assets'] = self
+        self.app = app
+        self.manifest_path = os.path.join(app.static_folder, DIST, MANIFEST)
+        if app.config['ASSETS_FINGERPRINT']:
+            self.manifest = self._load()
+        app.url_defaults(self._hashed_url)
+        self._static_view = app.view_functions['static']
+        app.view_functions['static'] = self._serve
+
+    def _load(self):
+        try:
+            built_at = os.path.getmtime(self.manifest_path)
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        fresh = {}
+        for source, built in manifest.items():
+            path = os.path.join(self.app.static_folder, source)
+            if os.path.exists(path) and os.path.getmtime(path) > built_at:
+                logger.warning('%s changed after the last asset build; serving it unhashed', source)
+            else:
+                fresh[source] = built
+        return fresh
+
+    def _hashed_url(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.manifest:
+            values['filename'] = self.manifest[values['filename']]
+
+    def _serve(self, filename):
+        # Only hashed names are immutable; the manifest keeps its name across builds
+        if not filename.startswith(f'{DIST}/') or not _FINGERPRINTED.search(filename):
+            return self._static_view(filename=filename)
+        folder = self.app.static_folder
+        available = [(encoding, suffix) for encoding, suffix in ENCODINGS
+                     if os.path.isfile(safe_join(folder, filename + suffix) or '')]
+        encoding = request.accept_encodings.best_match([encoding for encoding, _ in available])
+        if encoding is None:
+            response = send_from_directory(folder, filename, max_age=YEAR)
+        else:
+            suffix = dict(available)[encoding]
+            response = send_from_directory(folder, filename + suffix, max_age=YEAR,
+                                           mimetype=mimetypes.guess_type(filename)[0])
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
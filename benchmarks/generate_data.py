@@ -0,0 +1,288 @@
+"""Fill an SQLite database with a large synthetic forum for benchmarking.
+
+The defaults build roughly what a busy forum accumulates: 100k users, 50k
+topics, 1M posts with a long tail of very active threads, 1M comments
+concentrated on a few posts and 500k direct messages in long conversations.
+``--scale`` shrinks or grows every count but the 20 categories at once.
+
+Rows are written with ``executemany`` on a raw connection while the indexes
+and search triggers are dropped; the app then recreates the indexes,
+recomputes the denormalized counters and rebuilds the search index.
+
+Every generated user's password is ``password``. ``user1`` takes part in the
+longest conversations, so the benchmark logs in as that user.
+
+    python benchmarks/generate_data.py --database instance/bench.db --scale 0.1
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'  # how SQLAlchemy stores DateTime in SQLite
+BATCH_SIZE = 10000
+WORDS = (
+    'python flask sqlalchemy query index cache session template request response route '
+    'database migration schema column table join filter order limit offset cursor page '
+    'thread worker process memory latency throughput profile benchmark deploy docker '
+    'nginx gunicorn redis queue async await function class method module package import '
+    'error exception traceback debug log test fixture mock assert build release version '
+    'branch merge commit review refactor performance optimize slow fast bug fix issue '
+    'javascript css html react vue node npm webpack browser api json rest http header '
+    'token auth login password hash security cookie csrf cors server client config env'
+).split()
+CODE_SNIPPETS = (
+    "```python\nfor row in session.execute(query):\n    print(row.id, row.title)\n```",
+    "```javascript\nfetch('/api/posts').then(r => r.json()).then(render);\n```",
+    "```sql\nSELECT id, title FROM topic WHERE category_id = 3 ORDER BY created_at DESC;\n```",
+)
+
+
+def sentence(rng, low=6, high=18):
+    words = rng.choices(WORDS, k=rng.randint(low, high))
+    return ' '.join(words).capitalize() + '.'
+
+
+def body(rng):
+    paragraphs = [' '.join(sentence(rng) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 3))]
+    if rng.random() < 0.2:
+        paragraphs.insert(rng.randint(0, len(paragraphs)), rng.choice(CODE_SNIPPETS))
+    if rng.random() < 0.3:
+        paragraphs[-1] += f' Try `{rng.choice(WORDS)}()` first.'
+    return '\n\n'.join(paragraphs)
+
+
+def heavy_tail(rng, mean, cap):
+    # Pareto(1.5) - 1 has mean 2; most values are small, a few are huge.
+    # Adding a uniform [0, 1) before truncating keeps the mean unbiased.
+    return min(int((rng.paretovariate(1.5) - 1) * mean / 2 + rng.random()), cap)
+
+
+def timestamp(value):
+    return value.strftime(DATE_FORMAT)
+
+
+def batched(rows, size=BATCH_SIZE):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+class Generator:
+    def __init__(self, conn, rng, options, render):
+        self.conn = conn
+        self.rng = rng
+        self.options = options
+        self.now = datetime.utcnow()
+        self.start = self.now - timedelta(days=730)
+        self.counts = {}
+        # A fixed pool of bodies keeps rendering cheap: each is rendered once
+        self.bodies = []
+        for _ in range(2000):
+            columns = render(body(rng))
+            self.bodies.append((columns['content'], columns['content_html'], columns['content_html_version']))
+
+    def insert(self, table, columns, rows):
+        sql = f'INSERT INTO "{table}" ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+        total = 0
+        for batch in batched(rows):
+            self.conn.executemany(sql, batch)
+            total += len(batch)
+        self.conn.commit()
+        self.counts[table] = self.counts.get(table, 0) + total
+        return total
+
+    def moment(self, after=None, within=None):
+        after = after or self.start
+        span = (self.now - after).total_seconds()
+        if within is not None:
+            span = min(span, within.total_seconds())
+        return after + timedelta(seconds=self.rng.uniform(0, span))
+
+    def first_id(self, table):
+        return (self.conn.execute(f'SELECT max(id) FROM "{table}"').fetchone()[0] or 0) + 1
+
+    def users(self, password_hash):
+        first = self.first_id('user')
+        self.user_ids = range(first, first + self.options.users)
+        rows = ((user_id, f'user{n}', f'user{n}@example.com', password_hash,
+                 sentence(self.rng) if self.rng.random() < 0.2 else None, timestamp(self.moment()), 0)
+                for n, user_id in enumerate(self.user_ids, start=1))
+        self.insert('user', ('id', 'username', 'email', 'password_hash', 'bio', 'join_date', 'is_admin'), rows)
+        # A few users write most of the posts
+        self.author_weights = list(_cumulative(self.rng.paretovariate(1.2) for _ in self.user_ids))
+
+    def author(self):
+        return self.rng.choices(self.user_ids, cum_weights=self.author_weights)[0]
+
+    def categories(self):
+        first = self.first_id('category')
+        rows = [(first + n, f'{self.rng.choice(WORDS).capitalize()} {n + 1}', sentence(self.rng))
+                for n in range(self.options.categories)]
+        self.insert('category', ('id', 'name', 'description'), rows)
+        self.category_ids = [row[0] for row in self.conn.execute('SELECT id FROM category')]
+
+    def topics_posts_comments(self):
+        options, rng = self.options, self.rng
+        topic_ids = range(self.first_id('topic'), self.first_id('topic') + options.topics)
+        category_weights = list(_cumulative(rng.paretovariate(1.0) for _ in self.category_ids))
+        # Every topic has its opening post; the rest follow a long tail
+        extra = max(options.posts - options.topics, 0)
+        topic_weights = list(_cumulative(rng.paretovariate(1.1) for _ in topic_ids))
+        posts_per_topic = dict.fromkeys(topic_ids, 1)
+        for topic_id in rng.choices(topic_ids, cum_weights=topic_weights, k=extra):
+            posts_per_topic[topic_id] += 1
+        comments_per_post = options.comments / options.posts if options.posts else 0
+        topics, posts, comments = [], [], []
+        post_id, comment_id = self.first_id('post'), self.first_id('comment')
+        for topic_id in topic_ids:
+            created = self.moment()
+            topics.append((topic_id, sentence(rng, 3, 8)[:100], sentence(rng), timestamp(created),
+                           rng.choices(self.category_ids, cum_weights=category_weights)[0]))
+            stamps = sorted(self.moment(created, timedelta(days=60)) for _ in range(posts_per_topic[topic_id]))
+            stamps[0] = created
+            for posted in stamps:
+                content, html, version = rng.choice(self.bodies)
+                posts.append((post_id, content, html, version, timestamp(posted), timestamp(posted),
+                              self.author(), topic_id))
+                for _ in range(heavy_tail(rng, comments_per_post, 2000)):
+                    content, html, version = rng.choice(self.bodies)
+                    commented = timestamp(self.moment(posted, timedelta(days=7)))
+                    comments.append((comment_id, content, html, version, commented, commented,
+                                     self.author(), post_id))
+                    comment_id += 1
+                post_id += 1
+            if len(posts) >= BATCH_SIZE:
+                self._flush_thread_rows(topics, posts, comments)
+        self._flush_thread_rows(topics, posts, comments)
+
+    def _flush_thread_rows(self, topics, posts, comments):
+        self.insert('topic', ('id', 'title', 'description', 'created_at', 'category_id'), topics)
+        self.insert('post', ('id', 'content', 'content_html', 'content_html_version', 'created_at',
+                             'updated_at', 'user_id', 'topic_id'), posts)
+        self.insert('comment', ('id', 'content', 'content_html', 'content_html_version', 'created_at',
+                                'updated_at', 'user_id', 'post_id'), comments)
+        topics.clear()
+        posts.clear()
+        comments.clear()
+
+    def messages(self):
+        options, rng = self.options, self.rng
+        remaining = options.messages
+        me = self.user_ids[0]
+        rows = []
+        conversation = 0
+        while remaining > 0:
+            # Every fourth conversation involves user1, and those are the longest
+            mine = conversation % 4 == 0
+            length = min(remaining, max(1, heavy_tail(rng, options.messages_per_conversation, 20000)))
+            if mine:
+                length = min(remaining, length * 4)
+            first = me if mine else rng.choice(self.user_ids)
+            second = rng.choice(self.user_ids)
+            while second == first:
+                second = rng.choice(self.user_ids)
+            sent = self.moment()
+            unread_from = length - rng.randint(0, 5)
+            for n in range(length):
+                sender, recipient = (first, second) if rng.random() < 0.5 else (second, first)
+                sent += timedelta(seconds=rng.randint(5, 6 * 3600))
+                rows.append((rng.choice(self.bodies)[0][:500], timestamp(min(sent, self.now)),
+                             int(n < unread_from), sender, recipient))
+            remaining -= length
+            conversation += 1
+            if len(rows) >= BATCH_SIZE:
+                self.insert('message', ('content', 'created_at', 'is_read', 'sender_id', 'recipient_id'), rows)
+                rows = []
+        self.insert('message', ('content', 'created_at', 'is_read', 'sender_id', 'recipient_id'), rows)
+
+
+def _cumulative(weights):
+    total = 0
+    for weight in weights:
+        total += weight
+        yield total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default=os.path.join(ROOT, 'instance', 'bench.db'))
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply every default count')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--categories', type=int)
+    parser.add_argument('--topics', type=int)
+    parser.add_argument('--posts', type=int)
+    parser.add_argument('--comments', type=int)
+    parser.add_argument('--messages', type=int)
+    parser.add_argument('--messages-per-conversation', type=int, default=250)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--force', action='store_true', help='overwrite an existing database')
+    options = parser.parse_args()
+    if options.categories is None:
+        options.categories = 20
+    defaults = {'users': 100000, 'topics': 50000, 'posts': 1000000, 'comments': 1000000, 'messages': 500000}
+    for name, value in defaults.items():
+        if getattr(options, name) is None:
+            setattr(options, name, max(int(value * options.scale), 1))
+
+    path = os.path.abspath(options.database)
+    if os.path.exists(path):
+        if not options.force:
+            parser.error(f'{path} exists; pass --force to overwrite it')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    import app as forum
+    from werkzeug.security import generate_password_hash
+
+    started = time.perf_counter()
+    app = forum.create_app()
+    with app.app_context():
+        # Creates the schema, the search index and the admin account
+        forum.init_db()
+        forum.db.engine.dispose()
+        conn = sqlite3.connect(path)
+        conn.execute('PRAGMA synchronous = OFF')
+        indexes = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'")]
+        triggers = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'search_%'")]
+        for name in indexes:
+            conn.execute(f'DROP INDEX "{name}"')
+        for name in triggers:
+            conn.execute(f'DROP TRIGGER "{name}"')
+
+        generator = Generator(conn, random.Random(options.seed), options, forum.content_columns)
+        steps = [
+            ('users', lambda: generator.users(generate_password_hash('password'))),
+            ('categories', generator.categories),
+            ('topics, posts and comments', generator.topics_posts_comments),
+            ('messages', generator.messages),
+        ]
+        for label, step in steps:
+            step_started = time.perf_counter()
+            step()
+            print(f'{label}: {time.perf_counter() - step_started:.1f}s')
+        conn.close()
+
+        for label, step in [('indexes', forum.upgrade_schema), ('job queue', forum.jobs.create_table),
+                            ('counters', forum.rebuild_counters),
+                            ('search index', forum.rebuild_search_index)]:
+            step_started = time.perf_counter()
+            step()
+            print(f'{label}: {time.perf_counter() - step_started:.1f}s')
+
+    summary = ', '.join(f'{table}: {count}' for table, count in generator.counts.items())
+    print(f'Generated {summary} in {time.perf_counter() - started:.1f}s into {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""Benchmark the forum's main routes against a generated database.
+
+Drives the app through Flask's test client, so it measures the app itself
+without a web server in front. For every route it reports p50/p95/p99
+latency, SQL statements per request and the process RSS once the route has
+run, and writes the results to a JSON file that later runs can be compared
+against::
+
+    python benchmarks/generate_data.py --database instance/bench.db
+    python benchmarks/run_benchmarks.py --database instance/bench.db
+    python benchmarks/run_benchmarks.py --database instance/bench.db --compare benchmarks/results/<earlier>.json
+
+Public pages are requested anonymously; the inbox and conversation pages as
+``user1`` (see generate_data.py).
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        # Peak rather than current RSS; kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def pick_routes(forum):
+    """Representative URLs: the busiest rows plus typical ones."""
+    db = forum.db
+    category = forum.Category.query.order_by(forum.Category.topic_count.desc()).first()
+    busiest = forum.Topic.query.order_by(forum.Topic.post_count.desc()).first()
+    typical = forum.Topic.query.order_by(forum.Topic.post_count).offset(forum.Topic.query.count() // 2).first()
+    author = forum.User.query.order_by(forum.User.post_count.desc()).first()
+    me = forum.User.query.filter_by(username='user1').first()
+    if not (category and busiest and author and me):
+        raise SystemExit('The database looks empty; fill it with benchmarks/generate_data.py first.')
+    Message = forum.Message
+    partner_id = db.case((Message.sender_id == me.id, Message.recipient_id), else_=Message.sender_id)
+    partner = db.session.execute(
+        db.select(partner_id, db.func.count()).where(db.or_(Message.sender_id == me.id, Message.recipient_id == me.id))
+        .group_by(partner_id).order_by(db.func.count().desc()).limit(1)).first()
+    partner = db.session.get(forum.User, partner[0]) if partner else None
+    routes = [
+        ('index', '/', False),
+        ('category', f'/category/{category.id}', False),
+        ('category_page_5', f'/category/{category.id}/page/5', False),
+        ('topic_busiest', f'/topic/{busiest.id}', False),
+        ('topic_typical', f'/topic/{typical.id}', False),
+        ('search', '/search?query=python+cache', False),
+        ('profile', f'/profile/{author.username}', False),
+        ('messages', '/messages', True),
+    ]
+    if partner:
+        routes.append(('conversation', f'/messages/{partner.username}', True))
+    return routes
+
+
+def run_route(client, url, iterations, warmup, counter):
+    for _ in range(warmup):
+        client.get(url)
+    timings, queries, statuses = [], [], set()
+    for _ in range(iterations):
+        before = counter['queries']
+        started = time.perf_counter()
+        response = client.get(url)
+        response.get_data()
+        timings.append((time.perf_counter() - started) * 1000)
+        queries.append(counter['queries'] - before)
+        statuses.add(response.status_code)
+    return {
+        'url': url,
+        'status': sorted(statuses),
+        'iterations': iterations,
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'mean_ms': round(sum(timings) / len(timings), 2),
+        'queries_per_request': round(sum(queries) / len(queries), 2),
+        'max_queries': max(queries),
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f'\nCompared with {baseline_path} ({baseline.get("git_commit") or "unknown commit"}):')
+    print(f'{"route":<18}{"p50 ms":>20}{"p95 ms":>20}{"queries":>16}')
+    for name, result in results['routes'].items():
+        old = baseline['routes'].get(name)
+        if not old:
+            continue
+
+        def change(key):
+            before, after = old[key], result[key]
+            pct = f'{(after - before) / before * 100:+.0f}%' if before else 'n/a'
+            return f'{before:g}->{after:g} {pct}'
+        queries = f'{old["queries_per_request"]:g}->{result["queries_per_request"]:g}'
+        print(f'{name:<18}{change("p50_ms"):>20}{change("p95_ms"):>20}{queries:>16}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default=os.path.join(ROOT, 'instance', 'bench.db'))
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--routes', help='comma-separated route names to run (default: all)')
+    parser.add_argument('--no-cache', action='store_true', help='run with caching disabled (NullCache)')
+    parser.add_argument('--output', help='where to write the JSON results (default: benchmarks/results/)')
+    parser.add_argument('--compare', metavar='JSON', help='earlier results to compare against')
+    options = parser.parse_args()
+
+    path = os.path.abspath(options.database)
+    if not os.path.exists(path):
+        parser.error(f'{path} does not exist; create it with benchmarks/generate_data.py')
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    if options.no_cache:
+        os.environ['CACHE_TYPE'] = 'NullCache'
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    import app as forum
+
+    counter = {'queries': 0}
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        counter['queries'] += 1
+
+    app = forum.create_app({'RATELIMIT_ENABLED': False})
+    with app.app_context():
+        routes = pick_routes(forum)
+        row_counts = {model.__tablename__: model.query.count()
+                      for model in (forum.User, forum.Category, forum.Topic, forum.Post, forum.Comment,
+                                    forum.Message)}
+    if options.routes:
+        wanted = set(options.routes.split(','))
+        routes = [route for route in routes if route[0] in wanted]
+
+    anonymous = app.test_client()
+    signed_in = app.test_client()
+    response = signed_in.post('/login', data={'username': 'user1', 'password': 'password'})
+    if response.status_code != 302:
+        raise SystemExit('Could not sign in as user1; was the database made by generate_data.py?')
+
+    results = {
+        'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'database': path,
+        'rows': row_counts,
+        'settings': {'iterations': options.iterations, 'warmup': options.warmup,
+                     'cache_type': app.config['CACHE_TYPE']},
+        'routes': {},
+    }
+    print(f'{"route":<18}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"queries":>9}{"RSS MB":>9}')
+    for name, url, needs_login in routes:
+        rss_before = rss_mb()
+        result = run_route(signed_in if needs_login else anonymous, url, options.iterations, options.warmup,
+                           counter)
+        result['rss_mb'] = round(rss_mb(), 1)
+        result['rss_growth_mb'] = round(result['rss_mb'] - rss_before, 1)
+        results['routes'][name] = result
+        print(f'{name:<18}{result["p50_ms"]:>9}{result["p95_ms"]:>9}{result["p99_ms"]:>9}'
+              f'{result["queries_per_request"]:>9}{result["rss_mb"]:>9}')
+
+    output = options.output or os.path.join(
+        ROOT, 'benchmarks', 'results', f'{datetime.utcnow():%Y%m%d-%H%M%S}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {output}')
+    if options.compare:
+        compare(results, options.compare)
+
+
+if __name__ == '__main__':
+    main()
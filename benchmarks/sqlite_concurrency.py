@@ -0,0 +1,120 @@
+"""Concurrent read/write throughput of SQLite with and without the app's tuning.
+
+Runs the same workload twice on a scratch database: once with SQLAlchemy's
+defaults (rollback journal, synchronous=FULL) and once through
+``sqlite_tuning`` (WAL, synchronous=NORMAL, busy_timeout, larger caches).
+Readers page through a topic's posts; writers add a post and bump the topic's
+counter in one transaction, like the new_post route.
+
+    python benchmarks/sqlite_concurrency.py --readers 8 --writers 2 --seconds 10
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlite_tuning import DEFAULT_PRAGMAS, tune_engine  # noqa: E402
+
+POOL_OPTIONS = {'pool_size': 10, 'max_overflow': 20, 'pool_timeout': 10}
+READ = text('SELECT id, content, created_at FROM post WHERE topic_id = :topic_id '
+            'ORDER BY created_at, id LIMIT 10')
+INSERT = text('INSERT INTO post (topic_id, content, created_at) VALUES (:topic_id, :content, :created_at)')
+BUMP = text('UPDATE topic SET post_count = post_count + 1 WHERE id = :topic_id')
+
+
+def create_database(path, topics, posts):
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE topic (id INTEGER PRIMARY KEY, post_count INTEGER NOT NULL)'))
+        connection.execute(text('CREATE TABLE post (id INTEGER PRIMARY KEY, topic_id INTEGER NOT NULL, '
+                                'content TEXT NOT NULL, created_at DATETIME NOT NULL)'))
+        connection.execute(text('CREATE INDEX ix_post_topic_created ON post (topic_id, created_at, id)'))
+        connection.execute(text('INSERT INTO topic (id, post_count) VALUES (:id, 0)'),
+                           [{'id': i} for i in range(1, topics + 1)])
+        connection.execute(INSERT, [{'topic_id': random.randint(1, topics), 'content': 'x' * 400,
+                                     'created_at': datetime.utcnow()} for _ in range(posts)])
+    engine.dispose()
+
+
+def make_engine(path, profile):
+    if profile == 'default':
+        return create_engine(f'sqlite:///{path}')
+    return tune_engine(create_engine(f'sqlite:///{path}', **POOL_OPTIONS), DEFAULT_PRAGMAS)
+
+
+def run(path, profile, readers, writers, seconds, topics):
+    engine = make_engine(path, profile)
+    counts = {'reads': 0, 'writes': 0, 'read_errors': 0, 'write_errors': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def worker(kind):
+        done = errors = 0
+        while time.monotonic() < deadline:
+            topic_id = random.randint(1, topics)
+            try:
+                if kind == 'read':
+                    with engine.connect() as connection:
+                        connection.execute(READ, {'topic_id': topic_id}).fetchall()
+                else:
+                    with engine.begin() as connection:
+                        connection.execute(INSERT, {'topic_id': topic_id, 'content': 'y' * 400,
+                                                    'created_at': datetime.utcnow()})
+                        connection.execute(BUMP, {'topic_id': topic_id})
+                done += 1
+            except OperationalError:
+                errors += 1
+        with lock:
+            counts[f'{kind}s'] += done
+            counts[f'{kind}_errors'] += errors
+
+    threads = ([threading.Thread(target=worker, args=('read',)) for _ in range(readers)]
+               + [threading.Thread(target=worker, args=('write',)) for _ in range(writers)])
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    counts.update(profile=profile, reads_per_second=round(counts['reads'] / seconds, 1),
+                  writes_per_second=round(counts['writes'] / seconds, 1))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--topics', type=int, default=200)
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    options = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in ('default', 'tuned'):
+            path = os.path.join(directory, f'{profile}.db')
+            create_database(path, options.topics, options.posts)
+            results.append(run(path, profile, options.readers, options.writers, options.seconds, options.topics))
+
+    if options.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{options.readers} readers, {options.writers} writers, {options.seconds:g}s per profile')
+    print(f'{"profile":<10}{"reads/s":>12}{"writes/s":>12}{"read errors":>14}{"write errors":>14}')
+    for result in results:
+        print(f'{result["profile"]:<10}{result["reads_per_second"]:>12}{result["writes_per_second"]:>12}'
+              f'{result["read_errors"]:>14}{result["write_errors"]:>14}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""Cache backends for Flask-Caching.
+
+Pick one with ``CACHE_TYPE``:
+
+- ``cache_backends.LRUCache``: bounded in-process LRU (``CACHE_THRESHOLD`` entries)
+- ``FileSystemCache``: Flask-Caching's filesystem cache (``CACHE_DIR``)
+- ``RedisCache``: Flask-Caching's Redis cache (``CACHE_REDIS_URL``)
+- ``cache_backends.TwoTierCache``: an LRU in every worker in front of a shared
+  Redis, kept coherent across workers through pub/sub invalidation
+
+The two backends defined here count hits, misses and evictions; ``stats()``
+returns a snapshot of those counters.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from uuid import uuid4
+
+from flask_caching.backends.base import BaseCache
+from flask_caching.backends.rediscache import RedisCache
+
+logger = logging.getLogger(__name__)
+
+
+class CacheStats:
+    """Thread-safe counters shared by the cache backends."""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            counts = dict(self._counts)
+        lookups = counts.get('hits', 0) + counts.get('misses', 0)
+        counts['hit_rate'] = round(counts.get('hits', 0) / lookups, 4) if lookups else None
+        return counts
+
+
+class LRUCache(BaseCache):
+    """In-process cache that evicts the least recently used entry once it
+    holds ``threshold`` entries.
+
+    Values are stored as-is rather than pickled, so callers must treat what
+    they get back as read-only.
+    """
+
+    def __init__(self, threshold=500, default_timeout=300):
+        BaseCache.__init__(self, default_timeout=default_timeout)
+        self._threshold = threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(threshold=config['CACHE_THRESHOLD'])
+        return cls(*args, **kwargs)
+
+    def _expiry(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.monotonic() + timeout if timeout > 0 else 0
+
+    def _lookup(self, key):
+        # Caller holds the lock
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires and expires <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, value, timeout):
+        # Caller holds the lock
+        self._entries[key] = (self._expiry(timeout), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._threshold:
+            self._entries.popitem(last=False)
+            self._stats.incr('evictions')
+
+    def get(self, key):
+        with self._lock:
+            entry = self._lookup(key)
+        self._stats.incr('hits' if entry else 'misses')
+        return entry[1] if entry else None
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._store(key, value, timeout)
+        self._stats.incr('sets')
+        return True
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            if self._lookup(key):
+                return False
+            self._store(key, value, timeout)
+        self._stats.incr('sets')
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def has(self, key):
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        return True
+
+    def inc(self, key, delta=1):
+        with self._lock:
+            entry = self._lookup(key)
+            value = (entry[1] if entry else 0) + delta
+            self._store(key, value, None)
+        return value
+
+    def dec(self, key, delta=1):
+        return self.inc(key, -delta)
+
+    def stats(self):
+        counts = self._stats.snapshot()
+        with self._lock:
+            counts['size'] = len(self._entries)
+        counts['threshold'] = self._threshold
+        return counts
+
+
+class TwoTierCache(BaseCache):
+    """An LRUCache per worker (L1) in front of a shared Redis cache (L2).
+
+    Every write goes to both tiers and announces the key on a pub/sub
+    channel; each worker listens on that channel and drops the key from its
+    own L1. L1 entries also expire after ``local_timeout`` seconds so a lost
+    invalidation message cannot keep a worker stale for long.
+    """
+
+    def __init__(self, shared, local, channel='forum-cache-invalidate', local_timeout=30,
+                 default_timeout=300):
+        BaseCache.__init__(self, default_timeout=default_timeout)
+        self.shared = shared
+        self.local = local
+        self.channel = channel
+        self.local_timeout = local_timeout
+        self._node = uuid4().hex
+        self._stats = CacheStats()
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        shared = RedisCache.factory(app, config, [], dict(kwargs))
+        local = LRUCache(threshold=config['CACHE_THRESHOLD'], default_timeout=kwargs.get('default_timeout', 300))
+        kwargs.update(
+            channel=config.get('CACHE_INVALIDATION_CHANNEL', 'forum-cache-invalidate'),
+            local_timeout=config.get('CACHE_LOCAL_TIMEOUT', 30),
+        )
+        return cls(shared, local, *args, **kwargs)
+
+    def _local_timeout(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return min(timeout, self.local_timeout) if timeout > 0 else self.local_timeout
+
+    def _ensure_listener(self):
+        # Started lazily and per process, so workers forked from a preloaded
+        # master each get their own subscriber thread
+        if self._listener_pid == os.getpid():
+            return
+        with self._listener_lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            threading.Thread(target=self._listen, name='cache-invalidation', daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.shared._write_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Anything cached before the subscription started may be stale
+                self.local.clear()
+                for message in pubsub.listen():
+                    self._invalidated(message['data'])
+            except Exception:
+                logger.exception('Cache invalidation listener failed; resubscribing')
+                time.sleep(1)
+
+    def _invalidated(self, data):
+        if isinstance(data, bytes):
+            data = data.decode()
+        node, _, key = data.partition(':')
+        if node == self._node:
+            return
+        self._stats.incr('invalidations_received')
+        if key == '*':
+            self.local.clear()
+        else:
+            self.local.delete(key)
+
+    def _publish(self, key):
+        try:
+            self.shared._write_client.publish(self.channel, f'{self._node}:{key}')
+        except Exception:
+            logger.exception('Could not publish cache invalidation for %s', key)
+
+    def get(self, key):
+        self._ensure_listener()
+        value = self.local.get(key)
+        if value is not None:
+            self._stats.incr('hits')
+            self._stats.incr('local_hits')
+            return value
+        value = self.shared.get(key)
+        if value is None:
+            self._stats.incr('misses')
+            return None
+        self._stats.incr('hits')
+        self._stats.incr('shared_hits')
+        self.local.set(key, value, timeout=self.local_timeout)
+        return value
+
+    def set(self, key, value, timeout=None):
+        self._ensure_listener()
+        result = self.shared.set(key, value, timeout=timeout)
+        self.local.set(key, value, timeout=self._local_timeout(timeout))
+        self._publish(key)
+        self._stats.incr('sets')
+        return result
+
+    def add(self, key, value, timeout=None):
+        self._ensure_listener()
+        if not self.shared.add(key, value, timeout=timeout):
+            return False
+        self.local.set(key, value, timeout=self._local_timeout(timeout))
+        self._publish(key)
+        self._stats.incr('sets')
+        return True
+
+    def delete(self, key):
+        self.local.delete(key)
+        result = self.shared.delete(key)
+        self._publish(key)
+        return result
+
+    def has(self, key):
+        return self.local.has(key) or self.shared.has(key)
+
+    def clear(self):
+        self.local.clear()
+        result = self.shared.clear()
+        self._publish('*')
+        return result
+
+    def inc(self, key, delta=1):
+        value = self.shared.inc(key, delta)
+        self.local.delete(key)
+        self._publish(key)
+        return value
+
+    def dec(self, key, delta=1):
+        return self.inc(key, -delta)
+
+    def stats(self):
+        counts = self._stats.snapshot()
+        local = self.local.stats()
+        counts.update(evictions=local.get('evictions', 0), local_size=local['size'],
+                      local_threshold=local['threshold'])
+        return counts
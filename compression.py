@@ -0,0 +1,117 @@
+"""Response compression.
+
+``Compress`` encodes text responses with Brotli or gzip, whichever the
+client prefers, when their type is in ``COMPRESS_MIMETYPES``. Buffered
+bodies under ``COMPRESS_MIN_SIZE`` bytes are sent as they are, since
+compressing them saves next to nothing. Streamed bodies are compressed
+chunk by chunk and every chunk is flushed, so the browser gets the first
+bytes as soon as the app produces them. Brotli is offered only when the
+optional ``brotli`` package is installed.
+
+Files sent with ``send_file`` (static assets) are left alone, as are
+responses that already have a ``Content-Encoding``. A strong ETag on a
+compressed response is made weak, since the bytes differ from the
+uncompressed representation; ``If-None-Match`` still matches it.
+"""
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from flask import request
+
+DEFAULT_MIMETYPES = {'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+                     'application/json', 'image/svg+xml'}
+
+
+class _GzipStream:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliStream:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class Compress:
+    """Flask extension compressing responses in an ``after_request`` hook."""
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ENABLED', True)
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BR_LEVEL', 5)
+        app.config.setdefault('COMPRESS_MIMETYPES', DEFAULT_MIMETYPES)
+        app.extensions['compress'] = self
+        self.app = app
+        if app.config['COMPRESS_ENABLED']:
+            app.after_request(self._compress)
+
+    def _encoding(self):
+        offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+        return request.accept_encodings.best_match(offered)
+
+    def _stream(self, encoding):
+        config = self.app.config
+        if encoding == 'br':
+            return _BrotliStream(config['COMPRESS_BR_LEVEL'])
+        return _GzipStream(config['COMPRESS_LEVEL'])
+
+    def _compress(self, response):
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or response.direct_passthrough or 'Content-Encoding' in response.headers
+                or response.mimetype not in self.app.config['COMPRESS_MIMETYPES']):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self._encoding()
+        if encoding is None or request.method == 'HEAD':
+            return response
+        if response.is_streamed:
+            response.response = self._compress_chunks(response.iter_encoded(), self._stream(encoding),
+                                                      response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.app.config['COMPRESS_MIN_SIZE']:
+                return response
+            stream = self._stream(encoding)
+            response.set_data(stream.compress(data) + stream.finish())
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    @staticmethod
+    def _compress_chunks(chunks, stream, source):
+        try:
+            for chunk in chunks:
+                data = stream.compress(chunk)
+                if data:
+                    yield data
+            yield stream.finish()
+        finally:
+            # Closing the original iterable ends a streamed template's request context
+            close = getattr(source, 'close', None)
+            if close is not None:
+                close()
@@ -0,0 +1,91 @@
+"""Password hashing with a bounded cost.
+
+``CredentialService`` hashes and checks passwords on a small thread pool
+(hashlib releases the GIL while it works). At most ``PASSWORD_HASH_WORKERS``
+hashes run at once and at most ``PASSWORD_HASH_QUEUE_LIMIT`` more may wait;
+anything beyond that fails straight away with ``CredentialServiceBusy``, so
+a burst of logins is turned away instead of tying up every request worker.
+
+``PASSWORD_HASH_METHOD`` takes a Werkzeug method string such as
+``pbkdf2:sha256:600000`` or ``scrypt:32768:8:1``. Hashes made with other
+parameters still verify, and are replaced on the next successful login.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+class CredentialServiceBusy(Exception):
+    """Too many password hashes are running or queued."""
+
+
+def normalize_method(method):
+    """Spell out the defaults Werkzeug fills in, e.g. ``scrypt`` -> ``scrypt:32768:8:1``."""
+    name, *args = method.split(':')
+    if name == 'pbkdf2':
+        digest = args[0] if args else 'sha256'
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{digest}:{iterations}'
+    if name == 'scrypt':
+        defaults = ['32768', '8', '1']
+        return 'scrypt:' + ':'.join(args + defaults[len(args):])
+    return method
+
+
+class CredentialService:
+    def __init__(self, app=None):
+        self.method = None
+        self.timeout = None
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}')
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 4)
+        app.config.setdefault('PASSWORD_HASH_QUEUE_LIMIT', 16)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 10)
+        app.extensions['credentials'] = self
+        self.method = normalize_method(app.config['PASSWORD_HASH_METHOD'])
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self._slots = threading.BoundedSemaphore(self.workers + app.config['PASSWORD_HASH_QUEUE_LIMIT'])
+
+    def _submit(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise CredentialServiceBusy()
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise CredentialServiceBusy() from None
+
+    def hash(self, password):
+        return self._submit(generate_password_hash, password, self.method)
+
+    def needs_rehash(self, pwhash):
+        return pwhash.split('$', 1)[0] != self.method
+
+    def verify(self, pwhash, password):
+        """Check ``password``; returns ``(valid, new_hash)``.
+
+        ``new_hash`` is set when the password was right but ``pwhash`` was
+        made with different parameters, and should replace it.
+        """
+        if not pwhash:
+            return False, None
+        if not self._submit(check_password_hash, pwhash, password):
+            return False, None
+        return True, self.hash(password) if self.needs_rehash(pwhash) else None
@@ -0,0 +1,197 @@
+"""Stream database tables to and from newline-delimited JSON.
+
+An export is one JSON object per line: a header naming the format, then
+``{"table": ..., "row": {...}}`` for every row, table by table in the order
+given, then a footer with the row counts. Paths ending in ``.gz`` are
+gzipped and ``-`` means stdout/stdin. Rows are fetched through a server-side
+cursor (``yield_per``) and written as they arrive, so memory stays flat
+however big the tables are.
+
+Imports insert each batch of rows with a single ``executemany`` and commit
+it together with a checkpoint recording how many lines of the file are
+done. Running an interrupted import again with the same file skips those
+lines and carries on from there.
+"""
+import contextlib
+import gzip
+import json
+import sys
+import uuid
+from collections import deque
+from datetime import date, datetime
+from itertools import islice
+
+from sqlalchemy import Column, Date, DateTime, Integer, MetaData, String, Table, func, inspect, select
+
+FORMAT = 'devforum-export'
+VERSION = 1
+
+checkpoint_table = Table(
+    'import_checkpoint', MetaData(),
+    Column('export_id', String(32), primary_key=True),
+    Column('lines', Integer, nullable=False),
+)
+
+
+class TransferError(Exception):
+    """The file is not a usable export, or does not match the checkpoint."""
+
+
+def open_stream(path, mode='r'):
+    """Open ``path`` for reading (``'r'``) or writing (``'w'``) text."""
+    if path == '-':
+        return contextlib.nullcontext(sys.stdout if mode == 'w' else sys.stdin)
+    if path.endswith('.gz'):
+        # Level 1 compresses several times faster than the default for a slightly bigger file
+        return gzip.open(path, mode + 't', encoding='utf-8', compresslevel=1)
+    return open(path, mode, encoding='utf-8')
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+_dumps = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(',', ':')).encode
+
+
+def export_tables(conn, tables, out, batch_size=5000, progress=None):
+    """Write ``tables``, a list of ``(table, columns)`` pairs, to ``out``.
+
+    Returns the number of rows written per table.
+    """
+    counts = {}
+    out.write(_dumps({'format': FORMAT, 'version': VERSION, 'export_id': uuid.uuid4().hex,
+                      'exported_at': datetime.utcnow(), 'tables': [table.name for table, _ in tables]}) + '\n')
+    for table, columns in tables:
+        names = [column.name for column in columns]
+        stmt = select(*columns).order_by(*table.primary_key.columns)
+        count = 0
+        for row in conn.execution_options(yield_per=batch_size).execute(stmt):
+            out.write(_dumps({'table': table.name, 'row': dict(zip(names, row))}) + '\n')
+            count += 1
+            if progress and not count % batch_size:
+                progress(table.name, count)
+        counts[table.name] = count
+        if progress:
+            progress(table.name, count)
+    out.write(_dumps({'counts': counts}) + '\n')
+    return counts
+
+
+def read_header(stream):
+    line = stream.readline()
+    try:
+        header = json.loads(line)
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get('format') != FORMAT:
+        raise TransferError('Not a forum export: the first line has no export header.')
+    if header.get('version') != VERSION:
+        raise TransferError(f'Unsupported export version {header.get("version")!r}.')
+    return header
+
+
+def start_point(engine, header, restart=False):
+    """How many lines of this export an earlier run already imported.
+
+    ``None`` means the import starts from scratch. Raises ``TransferError``
+    when the checkpoint belongs to a different export, unless ``restart``.
+    """
+    if restart or not inspect(engine).has_table(checkpoint_table.name):
+        return None
+    with engine.connect() as conn:
+        saved = conn.execute(select(checkpoint_table)).first()
+    if saved is None:
+        return None
+    if saved.export_id != header['export_id']:
+        raise TransferError('An unfinished import of a different export is pending; '
+                            'import that file again to finish it, or restart.')
+    return saved.lines
+
+
+def _converters(columns):
+    parsers = {DateTime: datetime.fromisoformat, Date: date.fromisoformat}
+    return [(column.name, parser) for column in columns
+            for kind, parser in parsers.items() if isinstance(column.type, kind)]
+
+
+def import_tables(engine, stream, header, tables, skip=None, batch_size=5000, prepare=None, progress=None):
+    """Insert the rows that follow ``header`` in ``stream``.
+
+    ``tables`` is the list of ``(table, columns)`` pairs the export was made
+    with. ``skip`` is the result of ``start_point``: with ``None`` the
+    tables are emptied first, otherwise that many lines are skipped.
+    ``prepare`` maps table names to a function that can add derived columns
+    to each row. Returns the number of rows inserted per table.
+    """
+    specs = {table.name: (table, [column.name for column in columns], _converters(columns))
+             for table, columns in tables}
+    prepare = prepare or {}
+    lines = iter(stream)
+    export_id = header['export_id']
+    if skip is None:
+        with engine.begin() as conn:
+            checkpoint_table.create(conn, checkfirst=True)
+            for table, _ in reversed(tables):
+                conn.execute(table.delete())
+            conn.execute(checkpoint_table.delete())
+            conn.execute(checkpoint_table.insert().values(export_id=export_id, lines=0))
+        done = 0
+    else:
+        deque(islice(lines, skip), maxlen=0)
+        done = skip
+    counts = dict.fromkeys(specs, 0)
+    batch, batch_table = [], None
+
+    def flush():
+        with engine.begin() as conn:
+            if batch:
+                conn.execute(batch_table.insert(), batch)
+            conn.execute(checkpoint_table.update().where(checkpoint_table.c.export_id == export_id)
+                         .values(lines=done))
+        if batch and progress:
+            progress(batch_table.name, counts[batch_table.name])
+        batch.clear()
+
+    footer = None
+    for line in lines:
+        record = json.loads(line)
+        if 'counts' in record:
+            footer = record['counts']
+            break
+        try:
+            table, names, converters = specs[record['table']]
+        except KeyError:
+            raise TransferError(f'Line {done + 2} is for an unknown table {record.get("table")!r}.') from None
+        if table is not batch_table or len(batch) >= batch_size:
+            flush()
+            batch_table = table
+        values = record['row']
+        row = {name: values.get(name) for name in names}
+        for name, parse in converters:
+            if row[name] is not None:
+                row[name] = parse(row[name])
+        if table.name in prepare:
+            row = prepare[table.name](row)
+        batch.append(row)
+        counts[table.name] += 1
+        done += 1
+    if footer is None:
+        flush()
+        raise TransferError('The export ends without its footer; the file looks truncated.')
+    done += 1
+    flush()
+    with engine.connect() as conn:
+        for name, expected in footer.items():
+            table = specs[name][0]
+            found = conn.execute(select(func.count()).select_from(table)).scalar()
+            if found != expected:
+                raise TransferError(f'{name}: the export has {expected} rows but {found} were imported.')
+    return counts
+
+
+def finish_import(engine):
+    """Forget the checkpoint once the import and its rebuilds are done."""
+    checkpoint_table.drop(engine, checkfirst=True)
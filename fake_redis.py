@@ -0,0 +1,238 @@
+"""A small Redis-compatible server for local development and testing.
+
+It speaks enough of the RESP2 and RESP3 protocols for the forum's cache
+backends (``RedisCache`` and ``TwoTierCache``): strings with expiry,
+counters, key listing and pub/sub. Data lives in memory and is lost when it stops.
+
+Run it and point the cache at it::
+
+    python fake_redis.py --port 6390
+    CACHE_TYPE=cache_backends.TwoTierCache CACHE_REDIS_URL=redis://127.0.0.1:6390/0 python app.py
+"""
+import argparse
+import asyncio
+import fnmatch
+import time
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.channels = {}
+
+    # Storage helpers
+    def _alive(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _set(self, key, value, ttl=None):
+        self.data[key] = value
+        if ttl is None:
+            self.expires.pop(key, None)
+        else:
+            self.expires[key] = time.monotonic() + ttl
+
+    # Commands; each returns a Python value that encode() turns into RESP
+    def cmd_ping(self, *args):
+        return args[0] if args else 'PONG'
+
+    def cmd_get(self, key):
+        return self.data.get(key) if self._alive(key) else None
+
+    def cmd_mget(self, *keys):
+        return [self.cmd_get(key) for key in keys]
+
+    def cmd_set(self, key, value, *options):
+        options = [option.upper() for option in options]
+        ttl = None
+        if b'EX' in options:
+            ttl = int(options[options.index(b'EX') + 1])
+        elif b'PX' in options:
+            ttl = int(options[options.index(b'PX') + 1]) / 1000
+        if b'NX' in options and self._alive(key):
+            return None
+        if b'XX' in options and not self._alive(key):
+            return None
+        self._set(key, value, ttl)
+        return 'OK'
+
+    def cmd_setex(self, key, seconds, value):
+        self._set(key, value, int(seconds))
+        return 'OK'
+
+    def cmd_setnx(self, key, value):
+        if self._alive(key):
+            return 0
+        self._set(key, value)
+        return 1
+
+    def cmd_expire(self, key, seconds):
+        if not self._alive(key):
+            return 0
+        self.expires[key] = time.monotonic() + int(seconds)
+        return 1
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._alive(key):
+                removed += 1
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return removed
+
+    def cmd_exists(self, *keys):
+        return sum(1 for key in keys if self._alive(key))
+
+    def cmd_keys(self, pattern):
+        pattern = pattern.decode()
+        return [key for key in list(self.data) if self._alive(key) and fnmatch.fnmatchcase(key.decode(), pattern)]
+
+    def cmd_incrby(self, key, amount):
+        value = int(self.cmd_get(key) or 0) + int(amount)
+        self.data[key] = str(value).encode()
+        return value
+
+    def cmd_incr(self, key):
+        return self.cmd_incrby(key, 1)
+
+    def cmd_decrby(self, key, amount):
+        return self.cmd_incrby(key, -int(amount))
+
+    def cmd_flushdb(self, *args):
+        self.data.clear()
+        self.expires.clear()
+        return 'OK'
+
+    cmd_flushall = cmd_flushdb
+
+    def cmd_dbsize(self):
+        return sum(1 for key in list(self.data) if self._alive(key))
+
+    def cmd_select(self, index):
+        return 'OK'
+
+    def cmd_client(self, *args):
+        return 'OK'
+
+    def cmd_publish(self, channel, message):
+        subscribers = self.channels.get(channel, {})
+        for writer, protocol in list(subscribers.items()):
+            writer.write(encode([b'message', channel, message], protocol, push=True))
+        return len(subscribers)
+
+
+class CommandError(Exception):
+    pass
+
+
+def encode(value, protocol=2, push=False):
+    if value is None:
+        return b'_\r\n' if protocol == 3 else b'$-1\r\n'
+    if isinstance(value, CommandError):
+        return f'-ERR {value}\r\n'.encode()
+    if isinstance(value, str):
+        return f'+{value}\r\n'.encode()
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, int):
+        return f':{value}\r\n'.encode()
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    if isinstance(value, dict):
+        return b'%%%d\r\n' % len(value) + b''.join(
+            encode(key, protocol) + encode(item, protocol) for key, item in value.items())
+    prefix = b'>' if push and protocol == 3 else b'*'
+    return prefix + b'%d\r\n' % len(value) + b''.join(encode(item, protocol) for item in value)
+
+
+async def read_command(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b'*'):
+        # Inline command, as typed into telnet or redis-cli
+        return line.split()
+    args = []
+    for _ in range(int(line[1:])):
+        size = int((await reader.readline())[1:])
+        args.append((await reader.readexactly(size + 2))[:-2])
+    return args
+
+
+async def handle_client(server, reader, writer):
+    subscriptions = set()
+    protocol = 2
+    try:
+        while True:
+            args = await read_command(reader)
+            if args is None:
+                break
+            if not args:
+                continue
+            name, args = args[0].decode().lower(), args[1:]
+            if name == 'hello':
+                if args:
+                    protocol = int(args[0])
+                writer.write(encode({b'server': b'redis', b'version': b'7.0.0', b'proto': protocol,
+                                     b'mode': b'standalone', b'role': b'master', b'modules': []}, protocol))
+            elif name in ('subscribe', 'unsubscribe'):
+                channels = args or list(subscriptions)
+                for channel in channels:
+                    if name == 'subscribe':
+                        subscriptions.add(channel)
+                        server.channels.setdefault(channel, {})[writer] = protocol
+                    else:
+                        subscriptions.discard(channel)
+                        server.channels.get(channel, {}).pop(writer, None)
+                    writer.write(encode([name.encode(), channel, len(subscriptions)], protocol, push=True))
+            elif name == 'quit':
+                writer.write(encode('OK'))
+                break
+            else:
+                command = getattr(server, f'cmd_{name}', None)
+                try:
+                    if command is None:
+                        raise CommandError(f"unknown command '{name}'")
+                    result = command(*args)
+                except (TypeError, ValueError, IndexError) as e:
+                    result = CommandError(e)
+                except CommandError as e:
+                    result = e
+                writer.write(encode(result, protocol))
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        for channel in subscriptions:
+            server.channels.get(channel, {}).pop(writer, None)
+        writer.close()
+
+
+async def serve(host, port, ready=None):
+    server = FakeRedis()
+    listener = await asyncio.start_server(lambda r, w: handle_client(server, r, w), host, port)
+    if ready is not None:
+        ready(listener.sockets[0].getsockname()[1])
+    async with listener:
+        await listener.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6390)
+    options = parser.parse_args()
+    print(f'Fake Redis listening on {options.host}:{options.port}')
+    try:
+        asyncio.run(serve(options.host, options.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
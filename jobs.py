@@ -0,0 +1,260 @@
+"""Background jobs backed by a durable outbox table.
+
+``jobs.enqueue(kind, payload)`` inserts a row into ``job_outbox`` through the
+current database session, so the job is committed, or rolled back, together
+with the write that caused it and survives a restart. Once that transaction
+commits a dispatcher thread wakes up, claims the due jobs, groups them by
+kind and hands each group to its handler on a small thread pool: ten new
+posts cost one handler call, not ten. Handlers therefore receive a list of
+payloads and must be safe to run twice.
+
+A handler that raises has its whole batch retried after ``JOBS_RETRY_DELAY``
+seconds, doubling on every attempt; after ``JOBS_MAX_ATTEMPTS`` attempts the
+jobs stay in the table with status ``failed`` and their last error until
+``retry_failed()`` queues them again. Jobs
+claimed by a process that died are claimed again after ``JOBS_LEASE``
+seconds. The dispatcher also polls every ``JOBS_POLL_INTERVAL`` seconds for
+retries and for jobs enqueued by other processes.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from sqlalchemy import (Column, DateTime, Index, Integer, MetaData, String, Table, Text, and_, delete, event, exists,
+                        func, or_, select, update)
+
+logger = logging.getLogger(__name__)
+PENDING, RUNNING, FAILED = 'pending', 'running', 'failed'
+
+outbox = Table(
+    'job_outbox', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('kind', String(50), nullable=False),
+    Column('payload', Text, nullable=False),
+    Column('status', String(10), nullable=False),
+    Column('attempts', Integer, nullable=False, default=0),
+    Column('run_after', DateTime, nullable=False),
+    Column('claimed_by', String(32)),
+    Column('claimed_at', DateTime),
+    Column('last_error', Text),
+    Column('created_at', DateTime, nullable=False),
+    Index('ix_job_outbox_due', 'status', 'run_after'),
+    Index('ix_job_outbox_kind', 'kind', 'status'),
+)
+
+
+class KindStats:
+    def __init__(self):
+        self.jobs = 0
+        self.batches = 0
+        self.failures = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def summary(self):
+        return {
+            'jobs': self.jobs,
+            'batches': self.batches,
+            'failed_batches': self.failures,
+            'mean_batch_ms': round(self.total_time / self.batches * 1000, 2) if self.batches else None,
+            'max_batch_ms': round(self.max_time * 1000, 2),
+        }
+
+
+class JobQueue:
+    """Flask extension running ``@jobs.handler`` functions in the background."""
+
+    def __init__(self, app=None, db=None):
+        self.app = None
+        self.db = None
+        self.handlers = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._dispatcher = None
+        self._executor = None
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('JOBS_WORKERS', 2)
+        app.config.setdefault('JOBS_BATCH_SIZE', 100)
+        app.config.setdefault('JOBS_MAX_ATTEMPTS', 5)
+        app.config.setdefault('JOBS_RETRY_DELAY', 2)
+        app.config.setdefault('JOBS_POLL_INTERVAL', 5)
+        app.config.setdefault('JOBS_LEASE', 300)
+        app.extensions['jobs'] = self
+        self.app, self.db = app, db
+        event.listen(db.session, 'after_commit', self._after_commit)
+        event.listen(db.session, 'after_rollback', self._after_rollback)
+        # Threads start with the first request, not at import time, so CLI
+        # commands and pre-forking servers do not inherit them
+        app.before_request(self.start)
+
+    def create_table(self):
+        """Create the outbox table and its index if the database lacks them."""
+        with self.db.engine.begin() as conn:
+            outbox.create(conn, checkfirst=True)
+            for index in outbox.indexes:
+                index.create(conn, checkfirst=True)
+
+    def handler(self, kind):
+        """Register the decorated function as the handler for ``kind`` jobs."""
+        def register(func):
+            self.handlers[kind] = func
+            return func
+        return register
+
+    def enqueue(self, kind, payload=None):
+        """Add a job to the current transaction; it runs once that commits."""
+        if kind not in self.handlers:
+            raise KeyError(f'No handler registered for {kind!r} jobs')
+        now = datetime.utcnow()
+        session = self.db.session
+        session.execute(outbox.insert().values(kind=kind, payload=json.dumps(payload or {}), status=PENDING,
+                                               attempts=0, run_after=now, created_at=now))
+        session.info['jobs_enqueued'] = True
+
+    def pending(self, kind, key=None, value=None):
+        """A SQL expression that is true while ``kind`` jobs have work left undone.
+
+        Failed jobs count, as their work was never done. With ``key``, only jobs
+        whose payload lists ``value`` under that key, or lists anything there
+        when ``value`` is None.
+        """
+        query = exists().where(outbox.c.kind == kind, outbox.c.status.in_([PENDING, RUNNING, FAILED]))
+        if key is not None:
+            listed = func.json_each(outbox.c.payload, f'$.{key}').table_valued('value')
+            match = select(listed.c.value)
+            if value is not None:
+                match = match.where(listed.c.value == value)
+            query = query.where(match.exists())
+        return query
+
+    def retry_failed(self, kind=None):
+        """Queue failed jobs to run again from their first attempt; returns how many."""
+        stmt = update(outbox).where(outbox.c.status == FAILED)
+        if kind is not None:
+            stmt = stmt.where(outbox.c.kind == kind)
+        with self.db.engine.begin() as conn:
+            count = conn.execute(stmt.values(status=PENDING, attempts=0, run_after=datetime.utcnow())).rowcount
+        self._wake.set()
+        return count
+
+    def _after_commit(self, session):
+        if session.info.pop('jobs_enqueued', False):
+            self.start()
+            self._wake.set()
+
+    def _after_rollback(self, session):
+        session.info.pop('jobs_enqueued', None)
+
+    def start(self):
+        if self._dispatcher is not None:
+            return
+        with self._lock:
+            if self._dispatcher is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.app.config['JOBS_WORKERS'],
+                                                    thread_name_prefix='job-worker')
+                self._dispatcher = threading.Thread(target=self._run, name='job-dispatcher', daemon=True)
+                self._dispatcher.start()
+
+    def _run(self):
+        # Pick up whatever earlier runs left behind straight away
+        self._wake.set()
+        while True:
+            self._wake.wait(self.app.config['JOBS_POLL_INTERVAL'])
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    while self._run_pending():
+                        pass
+            except Exception:
+                logger.exception('Job dispatch failed')
+
+    def _run_pending(self):
+        jobs = self._claim()
+        groups = {}
+        for job in jobs:
+            groups.setdefault(job.kind, []).append(job)
+        futures = [self._executor.submit(self._run_batch, kind, batch) for kind, batch in groups.items()]
+        wait(futures)
+        return len(jobs)
+
+    def _claim(self):
+        config = self.app.config
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        due = select(outbox.c.id).where(or_(
+            and_(outbox.c.status == PENDING, outbox.c.run_after <= now),
+            and_(outbox.c.status == RUNNING, outbox.c.claimed_at < now - timedelta(seconds=config['JOBS_LEASE'])),
+        )).order_by(outbox.c.id).limit(config['JOBS_BATCH_SIZE'])
+        with self.db.engine.begin() as conn:
+            conn.execute(update(outbox).where(outbox.c.id.in_(due.scalar_subquery())).values(
+                status=RUNNING, claimed_by=token, claimed_at=now, attempts=outbox.c.attempts + 1))
+            return conn.execute(select(outbox).where(outbox.c.claimed_by == token).order_by(outbox.c.id)).all()
+
+    def _run_batch(self, kind, jobs):
+        started = time.perf_counter()
+        error = None
+        with self.app.app_context():
+            try:
+                handler = self.handlers.get(kind)
+                if handler is None:
+                    raise LookupError(f'No handler registered for {kind!r} jobs')
+                handler([json.loads(job.payload) for job in jobs])
+            except Exception as e:
+                logger.exception('%s job batch of %d failed', kind, len(jobs))
+                self.db.session.rollback()
+                error = f'{type(e).__name__}: {e}'
+            elapsed = time.perf_counter() - started
+            with self.db.engine.begin() as conn:
+                if error is None:
+                    conn.execute(delete(outbox).where(outbox.c.id.in_([job.id for job in jobs])))
+                else:
+                    self._retry_or_fail(conn, jobs, error)
+        with self._lock:
+            stats = self._stats.setdefault(kind, KindStats())
+            stats.jobs += len(jobs)
+            stats.batches += 1
+            stats.failures += error is not None
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+
+    def _retry_or_fail(self, conn, jobs, error):
+        config = self.app.config
+        now = datetime.utcnow()
+        for job in jobs:
+            values = {'claimed_by': None, 'claimed_at': None, 'last_error': error}
+            if job.attempts >= config['JOBS_MAX_ATTEMPTS'] or job.kind not in self.handlers:
+                values['status'] = FAILED
+            else:
+                delay = config['JOBS_RETRY_DELAY'] * 2 ** (job.attempts - 1)
+                values.update(status=PENDING, run_after=now + timedelta(seconds=delay))
+            conn.execute(update(outbox).where(outbox.c.id == job.id).values(**values))
+
+    def metrics(self):
+        """Outbox counts by kind and status plus this process's handler timings."""
+        now = datetime.utcnow()
+        with self.db.engine.connect() as conn:
+            rows = conn.execute(select(outbox.c.kind, outbox.c.status, func.count(), func.min(outbox.c.created_at))
+                                .group_by(outbox.c.kind, outbox.c.status)).all()
+        queued = {}
+        oldest = None
+        for kind, status, count, created in rows:
+            queued.setdefault(kind, {})[status] = count
+            if status == PENDING and (oldest is None or created < oldest):
+                oldest = created
+        with self._lock:
+            processed = {kind: stats.summary() for kind, stats in self._stats.items()}
+        return {
+            'running': self._dispatcher is not None and self._dispatcher.is_alive(),
+            'workers': self.app.config['JOBS_WORKERS'],
+            'outbox': queued,
+            'oldest_pending_seconds': round((now - oldest).total_seconds(), 1) if oldest else None,
+            'processed': processed,
+        }
@@ -0,0 +1,243 @@
+"""Opt-in per-request profiling.
+
+With ``PROFILING_ENABLED`` on, every request records how many SQL statements
+it ran, their total time and the slowest one (from SQLAlchemy engine events),
+the time spent rendering templates and the time spent inside the app's own
+Jinja filters. The numbers are sent back in a ``Server-Timing`` header
+(except on streamed pages, whose body is rendered after the headers are
+sent and which are recorded once the stream closes) and written as one JSON
+log line per request on the ``profiling`` logger;
+requests that run more than ``PROFILING_QUERY_BUDGET`` statements are logged
+as warnings.
+
+Timings are also aggregated per endpoint in memory for the admin profiling
+page. Memory stays bounded: there is one entry per endpoint, and each keeps
+only its last ``PROFILING_SAMPLES`` durations for the percentiles.
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from flask.logging import default_handler
+from jinja2.defaults import DEFAULT_FILTERS
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+MAX_STATEMENT_LENGTH = 500
+
+
+class RequestProfile:
+    __slots__ = ('started', 'queries', 'sql_time', 'slowest_sql', 'slowest_sql_time', 'template_time',
+                 'filter_time', 'render_starts', 'filter_depth')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.slowest_sql = None
+        self.slowest_sql_time = 0.0
+        self.template_time = 0.0
+        self.filter_time = 0.0
+        self.render_starts = []
+        self.filter_depth = 0
+
+
+def current_profile():
+    return g.get('_profile') if has_request_context() else None
+
+
+class EndpointStats:
+    def __init__(self, samples):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.total_queries = 0
+        self.max_queries = 0
+        self.over_budget = 0
+        self.slowest_sql = None
+        self.slowest_sql_time = 0.0
+        self.recent = deque(maxlen=samples)
+
+    def add(self, duration, profile, over_budget):
+        self.count += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.total_queries += profile.queries
+        self.max_queries = max(self.max_queries, profile.queries)
+        self.over_budget += over_budget
+        if profile.slowest_sql_time > self.slowest_sql_time:
+            self.slowest_sql, self.slowest_sql_time = profile.slowest_sql, profile.slowest_sql_time
+        self.recent.append(duration)
+
+    def summary(self, endpoint):
+        recent = sorted(self.recent)
+        return {
+            'endpoint': endpoint,
+            'count': self.count,
+            'mean_ms': round(self.total_time / self.count * 1000, 2),
+            'p95_ms': round(recent[max(0, int(len(recent) * 0.95 + 0.5) - 1)] * 1000, 2),
+            'max_ms': round(self.max_time * 1000, 2),
+            'mean_queries': round(self.total_queries / self.count, 1),
+            'max_queries': self.max_queries,
+            'over_budget': self.over_budget,
+            'slowest_sql': self.slowest_sql,
+            'slowest_sql_ms': round(self.slowest_sql_time * 1000, 2),
+        }
+
+
+class RequestProfiler:
+    """Flask extension that profiles requests when ``PROFILING_ENABLED`` is set."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        self._filters_wrapped = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILING_ENABLED', False)
+        app.config.setdefault('PROFILING_QUERY_BUDGET', 30)
+        app.config.setdefault('PROFILING_SAMPLES', 200)
+        app.config.setdefault('PROFILING_TOP_N', 20)
+        app.extensions['profiler'] = self
+        self.app = app
+        if not app.config['PROFILING_ENABLED']:
+            return
+        if not logger.handlers:
+            logger.addHandler(default_handler)
+            logger.setLevel(logging.INFO)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+        event.listen(Engine, 'before_cursor_execute', _query_started)
+        event.listen(Engine, 'after_cursor_execute', _query_finished)
+
+    @property
+    def enabled(self):
+        return bool(self.app and self.app.config['PROFILING_ENABLED'])
+
+    def _wrap_filters(self):
+        # Filters are registered after the extension, so wrap them on first use
+        env = self.app.jinja_env
+        for name, func in list(env.filters.items()):
+            if name not in DEFAULT_FILTERS:
+                env.filters[name] = _timed_filter(func)
+        self._filters_wrapped = True
+
+    def _start(self):
+        if not self._filters_wrapped:
+            self._wrap_filters()
+        g._profile = RequestProfile()
+
+    def _render_started(self, sender, template, context, **extra):
+        profile = current_profile()
+        if profile is not None:
+            profile.render_starts.append(time.perf_counter())
+
+    def _render_finished(self, sender, template, context, **extra):
+        profile = current_profile()
+        if profile is not None and profile.render_starts:
+            started = profile.render_starts.pop()
+            # Count only the outermost render when templates render templates
+            if not profile.render_starts:
+                profile.template_time += time.perf_counter() - started
+
+    def _finish(self, response):
+        profile = current_profile()
+        if profile is None:
+            return response
+        endpoint = request.endpoint or '<unmatched>'
+        if response.is_streamed:
+            # The body renders and queries after this hook, while the server sends it;
+            # record once it has been sent. The headers are gone by then, so no Server-Timing.
+            method, path = request.method, request.path
+            response.call_on_close(lambda: self._record(profile, method, path, endpoint, response.status_code))
+            return response
+        duration = self._record(profile, request.method, request.path, endpoint, response.status_code)
+        response.headers.add('Server-Timing', ', '.join([
+            f'db;dur={profile.sql_time * 1000:.2f};desc="{profile.queries} queries"',
+            f'tpl;dur={profile.template_time * 1000:.2f};desc="templates"',
+            f'filters;dur={profile.filter_time * 1000:.2f};desc="filters"',
+            f'total;dur={duration * 1000:.2f}',
+        ]))
+        return response
+
+    def _record(self, profile, method, path, endpoint, status):
+        duration = time.perf_counter() - profile.started
+        budget = self.app.config['PROFILING_QUERY_BUDGET']
+        over_budget = profile.queries > budget
+        logger.log(logging.WARNING if over_budget else logging.INFO, json.dumps({
+            'method': method,
+            'path': path,
+            'endpoint': endpoint,
+            'status': status,
+            'duration_ms': round(duration * 1000, 2),
+            'queries': profile.queries,
+            'sql_ms': round(profile.sql_time * 1000, 2),
+            'slowest_sql_ms': round(profile.slowest_sql_time * 1000, 2),
+            'slowest_sql': profile.slowest_sql,
+            'template_ms': round(profile.template_time * 1000, 2),
+            'filter_ms': round(profile.filter_time * 1000, 2),
+            'query_budget_exceeded': over_budget,
+        }))
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = EndpointStats(self.app.config['PROFILING_SAMPLES'])
+            stats.add(duration, profile, over_budget)
+        return duration
+
+    def slowest(self, limit=None):
+        """Per-endpoint summaries, slowest 95th percentile first."""
+        with self._lock:
+            summaries = [stats.summary(endpoint) for endpoint, stats in self._endpoints.items()]
+        summaries.sort(key=lambda summary: summary['p95_ms'], reverse=True)
+        return summaries[:limit or self.app.config['PROFILING_TOP_N']]
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('profile_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    profile = current_profile()
+    if profile is None:
+        return
+    profile.queries += 1
+    profile.sql_time += elapsed
+    if elapsed > profile.slowest_sql_time:
+        profile.slowest_sql, profile.slowest_sql_time = ' '.join(statement.split())[:MAX_STATEMENT_LENGTH], elapsed
+
+
+def _timed_filter(func):
+    @wraps(func)
+    def timed(*args, **kwargs):
+        profile = current_profile()
+        if profile is None:
+            return func(*args, **kwargs)
+        # Filters can call other filters; time only the outer call
+        profile.filter_depth += 1
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.filter_depth -= 1
+            if not profile.filter_depth:
+                profile.filter_time += time.perf_counter() - started
+    return timed
@@ -0,0 +1,55 @@
+"""SQLite connection tuning shared by the app and the concurrency benchmark.
+
+Every new connection gets the ``PRAGMA`` settings in ``DEFAULT_PRAGMAS``:
+
+- ``journal_mode=WAL``: readers keep reading while a writer commits
+- ``synchronous=NORMAL``: no fsync per commit, only at checkpoints (safe with WAL)
+- ``busy_timeout``: wait for a lock instead of failing with "database is locked"
+- ``cache_size`` / ``mmap_size``: a larger page cache and memory-mapped reads
+"""
+import sqlite3
+
+from sqlalchemy import create_engine, event
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+# journal_mode is a property of the database file; only writers may change it
+_DATABASE_PRAGMAS = {'journal_mode'}
+
+
+def apply_pragmas(dbapi_connection, pragmas, read_only=False):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            if read_only and name in _DATABASE_PRAGMAS:
+                continue
+            cursor.execute(f'PRAGMA {name} = {value}')
+        if read_only:
+            cursor.execute('PRAGMA query_only = ON')
+    finally:
+        cursor.close()
+
+
+def tune_engine(engine, pragmas, read_only=False):
+    """Apply ``pragmas`` to every connection ``engine`` opens from now on."""
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        if isinstance(dbapi_connection, sqlite3.Connection):
+            apply_pragmas(dbapi_connection, pragmas, read_only=read_only)
+    return engine
+
+
+def is_file_database(url):
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def create_read_only_engine(url, pragmas, **options):
+    """A second engine on the same SQLite file that opens it with ``mode=ro``."""
+    url = url.set(database=f'file:{url.database}', query={**url.query, 'mode': 'ro', 'uri': 'true'})
+    return tune_engine(create_engine(url, **options), pragmas, read_only=True)
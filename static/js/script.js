@@ -6,7 +6,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Handle form submissions that need loading spinners
     // This handles both "Reply Topic" and "New Topic" forms
-    const formsWithSpinner = document.querySelectorAll('form[action^="/post/new/"], form[action^="/topic/new/"]');
+    const formsWithSpinner = document.querySelectorAll('form[action^="/post/new/"]:not(.quick-reply), form[action^="/topic/new/"]');
     formsWithSpinner.forEach(form => {
         form.addEventListener('submit', function(e) {
             const submitButton = this.querySelector('button[type="submit"]');
@@ -21,86 +21,13 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 
-    // Handle comment form submissions with AJAX
-    const commentForms = document.querySelectorAll('form[action^="/comment/new/"]');
-    commentForms.forEach(form => {
-        form.addEventListener('submit', function(e) {
-            e.preventDefault();
-
-            const formData = new FormData(form);
-            const postId = form.action.split('/').pop();
-            const commentsContainer = form.closest('.flex-grow-1').querySelector('.comments');
-            const textarea = form.querySelector('textarea');
-            const submitButton = form.querySelector('button[type="submit"]');
-
-            // Store original button text
-            const originalButtonText = submitButton.innerHTML;
-
-            // Create and show loading spinner
-            submitButton.innerHTML = '<div class="loading-spinner"></div> Posting...';
-            submitButton.disabled = true;
-
-            // Create comments container if it doesn't exist
-            let commentsDiv = commentsContainer;
-            if (!commentsDiv) {
-                commentsDiv = document.createElement('div');
-                commentsDiv.className = 'comments mt-3';
-                commentsDiv.innerHTML = '<h6>Comments:</h6>';
-                form.closest('.flex-grow-1').insertBefore(commentsDiv, form.parentNode);
-            }
-
-            // Send AJAX request
-            fetch(form.action, {
-                method: 'POST',
-                body: formData,
-                headers: {
-                    'X-Requested-With': 'XMLHttpRequest'
-                }
-            })
-            .then(response => response.json())
-            .then(data => {
-                // Create new comment element
-                const commentDiv = document.createElement('div');
-                commentDiv.className = 'comment p-2 mb-2 bg-light rounded';
-                commentDiv.innerHTML = `
-                    <div class="d-flex justify-content-between mb-1">
-                        <div>
-                            <a href="${data.author.profile_url}">${data.author.username}</a>
-                        </div>
-                        <div class="text-muted small">
-                            ${data.time_since}
-                        </div>
-                    </div>
-                    <div>${data.formatted_content}</div>
-                `;
-
-                // Add the new comment to the comments container
-                if (!commentsContainer) {
-                    commentsDiv.appendChild(commentDiv);
-                } else {
-                    commentsContainer.appendChild(commentDiv);
-                }
-
-                // Clear the textarea
-                textarea.value = '';
-
-                // Highlight code in the new comment
-                Prism.highlightAllUnder(commentDiv);
-
-                // Restore button state
-                submitButton.innerHTML = originalButtonText;
-                submitButton.disabled = false;
-            })
-            .catch(error => {
-                console.error('Error:', error);
-                alert('An error occurred while submitting your comment. Please try again.');
-
-                // Restore button state on error
-                submitButton.innerHTML = originalButtonText;
-                submitButton.disabled = false;
-            });
-        });
-    });
+    // Topic pages: comments and quick replies are posted to the thread API and
+    // appended in place; on the last page new posts and comments from other
+    // users are polled for and appended as well
+    const thread = document.querySelector('.thread');
+    if (thread) {
+        initThread(thread);
+    }
 
     // Initialize tooltips
     var tooltipTriggerList = [].slice.call(document.querySelectorAll('[data-bs-toggle="tooltip"]'));
@@ -248,3 +175,211 @@ function addDarkModeToggle() {
 
 // Call the function after DOM is loaded
 document.addEventListener('DOMContentLoaded', addDarkModeToggle);
+
+// Live topic threads
+const THREAD_POLL_INTERVAL = 15000;
+
+function escapeHtml(value) {
+    const div = document.createElement('div');
+    div.textContent = value;
+    return div.innerHTML;
+}
+
+// Same absolute UTC format as the server-rendered thread, which is cached and
+// revalidated, so relative "5 minutes ago" labels would go stale in it
+function formatTime(isoTimestamp) {
+    return isoTimestamp.slice(0, 16).replace('T', ' ');
+}
+
+function renderComment(comment) {
+    const commentDiv = document.createElement('div');
+    commentDiv.className = 'comment p-2 mb-2 bg-light rounded';
+    commentDiv.dataset.id = comment.id;
+    commentDiv.innerHTML = `
+        <div class="d-flex justify-content-between mb-1">
+            <div>
+                <a href="${comment.author.profile_url}">${escapeHtml(comment.author.username)}</a>
+            </div>
+            <div class="text-muted small">
+                ${formatTime(comment.created_at)}
+            </div>
+        </div>
+        <div>${comment.html}</div>
+    `;
+    return commentDiv;
+}
+
+function renderPost(post, signedIn, commentsUrl) {
+    const postDiv = document.createElement('div');
+    postDiv.className = 'post p-3 border-top';
+    postDiv.id = `post-${post.id}`;
+    postDiv.dataset.id = post.id;
+    const commentForm = signedIn ? `
+        <div class="mt-3">
+            <form action="/comment/new/${post.id}" method="post" data-api-url="${commentsUrl}">
+                <div class="mb-2">
+                    <textarea class="form-control" name="content" rows="4" style="min-height: 100px;" placeholder="Add a comment..." required></textarea>
+                </div>
+                <div class="d-flex justify-content-end">
+                    <button class="btn btn-outline-primary" type="submit">Comment</button>
+                </div>
+            </form>
+        </div>` : '';
+    postDiv.innerHTML = `
+        <div class="d-flex">
+            <div class="flex-shrink-0 me-3 text-center" style="width: 150px;">
+                <div class="mb-2">
+                    <i class="bi bi-person-circle" style="font-size: 3rem;"></i>
+                </div>
+                <div>
+                    <a href="${post.author.profile_url}">${escapeHtml(post.author.username)}</a>
+                </div>
+                <div class="text-muted small">
+                    Joined: ${post.author.join_date}
+                </div>
+            </div>
+            <div class="flex-grow-1">
+                <div class="d-flex justify-content-between mb-2">
+                    <div class="text-muted small">
+                        Posted: ${formatTime(post.created_at)}
+                    </div>
+                    <div>
+                        <a href="#post-${post.id}" class="badge bg-secondary text-decoration-none">#${post.id}</a>
+                    </div>
+                </div>
+                <div class="post-content mb-3">
+                    ${post.html}
+                </div>
+                ${commentForm}
+            </div>
+        </div>
+    `;
+    post.comments.forEach(comment => appendComment(postDiv, comment));
+    return postDiv;
+}
+
+function appendComment(postDiv, comment) {
+    if (postDiv.querySelector(`.comment[data-id="${comment.id}"]`)) {
+        return;
+    }
+    const body = postDiv.querySelector('.flex-grow-1');
+    let commentsDiv = body.querySelector('.comments');
+    if (!commentsDiv) {
+        commentsDiv = document.createElement('div');
+        commentsDiv.className = 'comments mt-3';
+        commentsDiv.innerHTML = '<h6>Comments:</h6>';
+        const form = body.querySelector('form');
+        body.insertBefore(commentsDiv, form ? form.parentNode : null);
+    }
+    const commentDiv = renderComment(comment);
+    commentsDiv.appendChild(commentDiv);
+    Prism.highlightAllUnder(commentDiv);
+}
+
+function appendPost(thread, post) {
+    if (thread.querySelector(`.post[data-id="${post.id}"]`)) {
+        return;
+    }
+    const placeholder = thread.querySelector('.no-posts');
+    if (placeholder) {
+        placeholder.remove();
+    }
+    const postDiv = renderPost(post, thread.dataset.signedIn === 'true', `/api/posts/${post.id}/comments`);
+    thread.querySelector('.thread-posts').appendChild(postDiv);
+    Prism.highlightAllUnder(postDiv);
+}
+
+function maxId(elements) {
+    return Array.from(elements).reduce((max, element) => Math.max(max, parseInt(element.dataset.id, 10)), 0);
+}
+
+function postJson(url, form) {
+    return fetch(url, {
+        method: 'POST',
+        body: new FormData(form),
+        headers: {'Accept': 'application/json'}
+    }).then(response => {
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        return response.json();
+    });
+}
+
+function submitWithSpinner(form, request) {
+    const submitButton = form.querySelector('button[type="submit"]');
+    const originalButtonText = submitButton.innerHTML;
+    submitButton.innerHTML = '<div class="loading-spinner"></div> Posting...';
+    submitButton.disabled = true;
+    request()
+    .then(() => {
+        form.querySelector('textarea').value = '';
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        alert('An error occurred while submitting. Please try again.');
+    })
+    .finally(() => {
+        submitButton.innerHTML = originalButtonText;
+        submitButton.disabled = false;
+    });
+}
+
+function initThread(thread) {
+    // Comment forms, including those on posts appended later
+    thread.addEventListener('submit', function(e) {
+        const form = e.target;
+        if (!form.matches('form[action^="/comment/new/"]')) {
+            return;
+        }
+        e.preventDefault();
+        submitWithSpinner(form, () => postJson(form.dataset.apiUrl, form)
+            .then(comment => appendComment(form.closest('.post'), comment)));
+    });
+
+    const quickReply = thread.querySelector('form.quick-reply');
+    if (quickReply) {
+        quickReply.addEventListener('submit', function(e) {
+            e.preventDefault();
+            submitWithSpinner(quickReply, () => postJson(quickReply.dataset.apiUrl, quickReply)
+                .then(post => appendPost(thread, post)));
+        });
+    }
+
+    if (thread.dataset.live !== 'true') {
+        return;
+    }
+    let etag = null;
+    function poll() {
+        const since = maxId(thread.querySelectorAll('.post[data-id]'));
+        const headers = etag ? {'If-None-Match': etag} : {};
+        fetch(`${thread.dataset.postsUrl}?since=${since}`, {headers: headers, cache: 'no-store'})
+        .then(response => {
+            if (response.status === 304 || !response.ok) {
+                return;
+            }
+            const firstPoll = etag === null;
+            etag = response.headers.get('ETag');
+            return response.json().then(data => {
+                data.posts.forEach(post => appendPost(thread, post));
+                // The thread changed; fetch comments added to the posts already shown
+                const shown = Array.from(thread.querySelectorAll('.post[data-id]')).slice(-50);
+                const lastComment = maxId(thread.querySelectorAll('.comment[data-id]'));
+                if (firstPoll || !shown.length || lastComment >= (data.last_comment_id || 0)) {
+                    return;
+                }
+                const query = shown.map(post => `post_id=${post.dataset.id}`).join('&');
+                return fetch(`${thread.dataset.commentsUrl}?${query}&since=${lastComment}`, {cache: 'no-store'})
+                .then(response => response.json())
+                .then(data => {
+                    shown.forEach(postDiv => {
+                        (data.comments[postDiv.dataset.id] || []).forEach(comment => appendComment(postDiv, comment));
+                    });
+                });
+            });
+        })
+        .catch(error => console.error('Error:', error));
+    }
+    poll();
+    setInterval(poll, THREAD_POLL_INTERVAL);
+}
@@ -0,0 +1,86 @@
+import os
+import sys
+from collections import namedtuple
+from itertools import count
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as forum
+
+PASSWORD = 'password'
+Account = namedtuple('Account', 'id username')
+TopicRef = namedtuple('TopicRef', 'id category_id author_id')
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    # The extensions are module-level singletons, so the tests share one app
+    path = tmp_path_factory.mktemp('db') / 'forum.db'
+    app = forum.create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test',
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'CACHE_TYPE': 'NullCache',
+        'RATELIMIT_ENABLED': False,
+        'WTF_CSRF_ENABLED': False,
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+    })
+    with app.app_context():
+        forum.init_db()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture(scope='session')
+def make_user(app):
+    """Create a user with a fresh name and PASSWORD; returns its Account."""
+    numbers = count(1)
+
+    def make_user():
+        username = f'user{next(numbers)}'
+        with app.app_context():
+            user = forum.User(username=username, email=f'{username}@example.com')
+            user.set_password(PASSWORD)
+            forum.db.session.add(user)
+            forum.db.session.commit()
+            return Account(user.id, username)
+    return make_user
+
+
+@pytest.fixture(scope='session')
+def make_topic(app, make_user):
+    """Create a topic by a new user, with its counters rebuilt; returns its TopicRef."""
+    def make_topic(title='Topic', posts=1, comments_per_post=0):
+        author = make_user()
+        with app.app_context():
+            category = forum.Category.query.first()
+            topic = forum.Topic(title=title, category_id=category.id)
+            rows = [forum.Post(**forum.content_columns(f'Post {number} of {title}'), user_id=author.id, topic=topic)
+                    for number in range(posts)]
+            for post in rows:
+                for reply in range(comments_per_post):
+                    post.comments.append(forum.Comment(**forum.content_columns(f'Reply {reply}'), user_id=author.id))
+            forum.db.session.add_all(rows)
+            forum.db.session.commit()
+            forum.rebuild_counters(topics=[topic.id], categories=[category.id], users=[author.id],
+                                   posts=[post.id for post in rows])
+            return TopicRef(topic.id, category.id, author.id)
+    return make_topic
+
+
+@pytest.fixture
+def user(make_user):
+    return make_user()
+
+
+@pytest.fixture
+def signed_in(client, user):
+    """The test client, signed in as ``user``."""
+    assert client.post('/login', data={'username': user.username, 'password': PASSWORD}).status_code == 302
+    return client
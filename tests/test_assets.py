@@ -0,0 +1,21 @@
+from flask import Flask
+
+from assets import Assets, build_assets
+
+
+def test_only_hashed_files_are_immutable(tmp_path):
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'css' / 'style.css').write_text('body { color: red; }\n')
+    built = build_assets(str(tmp_path))['css/style.css']
+    app = Flask(__name__, static_folder=str(tmp_path), static_url_path='/static')
+    Assets(app)
+    client = app.test_client()
+
+    hashed = client.get(f'/static/{built}')
+    assert hashed.cache_control.immutable
+    assert hashed.cache_control.max_age == 365 * 24 * 3600
+
+    manifest = client.get('/static/dist/manifest.json')
+    assert manifest.status_code == 200
+    assert not manifest.cache_control.immutable
+    assert manifest.cache_control.no_cache
@@ -0,0 +1,54 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as forum
+from jobs import outbox
+
+
+@pytest.fixture(scope='module')
+def topic(make_topic):
+    return make_topic('Validators')
+
+
+@pytest.fixture(params=['pending', 'failed'])
+def queued_refresh(app, topic, request):
+    # Due far in the future, so the dispatcher leaves it queued
+    now = datetime.utcnow()
+    with app.app_context(), forum.db.engine.begin() as conn:
+        job_id = conn.execute(outbox.insert().values(
+            kind='refresh_counters', payload=json.dumps({'categories': [topic.category_id], 'topics': [topic.id]}),
+            status=request.param, attempts=0, run_after=now + timedelta(days=1), created_at=now)).inserted_primary_key[0]
+    yield
+    with app.app_context(), forum.db.engine.begin() as conn:
+        conn.execute(outbox.delete().where(outbox.c.id == job_id))
+
+
+@pytest.fixture(params=['/', '/category/{category}', '/topic/{topic}'])
+def page_url(topic, request):
+    return request.param.format(category=topic.category_id, topic=topic.id)
+
+
+def test_pages_revalidate_once_counters_are_settled(client, page_url):
+    etag = client.get(page_url).headers['ETag']
+    assert client.get(page_url, headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_pages_carry_no_validators_while_a_counter_refresh_is_queued(client, queued_refresh, page_url):
+    response = client.get(page_url)
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+    assert 'Last-Modified' not in response.headers
+
+
+def test_other_topics_keep_their_validators(client, make_topic, queued_refresh):
+    other = make_topic('Unrelated')
+    assert 'ETag' in client.get(f'/topic/{other.id}').headers
+
+
+def test_revalidated_pages_hold_no_relative_times(client, page_url):
+    # A 304 can keep a page for days, so "just now" would never be corrected
+    page = client.get(page_url).get_data(as_text=True)
+    assert 'just now' not in page
+    assert ' ago' not in page
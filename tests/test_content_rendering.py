@@ -0,0 +1,22 @@
+import app as forum
+
+
+def test_text_outside_code_is_escaped():
+    html = forum.render_content('<script>alert(1)</script>\n```python\nif a < b: pass\n```')
+    assert '<script>' not in html
+    assert '&lt;script&gt;alert(1)&lt;/script&gt;<br>' in html
+    assert '<code class="language-python">if a &lt; b: pass</code>' in html
+
+
+def test_outdated_rows_are_not_written_on_read(app, client, make_topic):
+    topic = make_topic('Old markup')
+    with app.app_context():
+        post = forum.Post(content='<b>old</b>', content_html='<b>old</b>', content_html_version=1,
+                          user_id=topic.author_id, topic_id=topic.id)
+        forum.db.session.add(post)
+        forum.db.session.commit()
+        post_id = post.id
+    page = client.get(f'/topic/{topic.id}').get_data(as_text=True)
+    assert '&lt;b&gt;old&lt;/b&gt;' in page
+    with app.app_context():
+        assert forum.db.session.get(forum.Post, post_id).content_html_version == 1
@@ -0,0 +1,27 @@
+import app as forum
+
+
+def test_snapshot_equals_its_user_row(app, user, make_user):
+    other = make_user()
+    with app.app_context():
+        row = forum.db.session.get(forum.User, user.id)
+        snapshot = forum.load_user(row.get_id())
+        assert snapshot == row
+        assert row == snapshot
+        assert snapshot == forum.load_user(row.get_id())
+        assert hash(snapshot) == hash(forum.load_user(row.get_id()))
+        assert snapshot != forum.db.session.get(forum.User, other.id)
+        assert snapshot != user.username
+
+
+def test_own_profile_offers_edit(signed_in, user):
+    page = signed_in.get(f'/profile/{user.username}').get_data(as_text=True)
+    assert 'Edit Profile' in page
+    assert 'Send Message' not in page
+
+
+def test_other_profile_offers_message(signed_in, make_user):
+    other = make_user()
+    page = signed_in.get(f'/profile/{other.username}').get_data(as_text=True)
+    assert 'Send Message' in page
+    assert 'Edit Profile' not in page
@@ -0,0 +1,30 @@
+from flask import Flask, stream_template_string
+from sqlalchemy import create_engine, text
+
+from profiling import RequestProfiler
+
+PAGE = '{% for row in rows() %}{{ row }}{% endfor %}'
+
+
+def test_streamed_page_is_recorded_once_sent():
+    engine = create_engine('sqlite://')
+    app = Flask(__name__)
+    app.config['PROFILING_ENABLED'] = True
+    profiler = RequestProfiler(app)
+
+    def rows():
+        with engine.connect() as conn:
+            return [conn.execute(text('SELECT 1')).scalar() for _ in range(3)]
+
+    @app.route('/streamed')
+    def streamed():
+        return stream_template_string(PAGE, rows=rows)
+
+    response = app.test_client().get('/streamed')
+    assert 'Server-Timing' not in response.headers
+    assert response.get_data(as_text=True) == '111'
+    assert profiler.slowest() == []
+    response.close()
+    [summary] = profiler.slowest()
+    assert summary['endpoint'] == 'streamed'
+    assert summary['max_queries'] == 3
@@ -0,0 +1,10 @@
+import pytest
+
+
+@pytest.mark.parametrize('cursor', ['after', 'before'])
+def test_bad_cursor_is_not_found(signed_in, user, make_user, make_topic, cursor):
+    topic = make_topic('Streaming')
+    correspondent = make_user()
+    for url in [f'/profile/{user.username}', f'/topic/{topic.id}', f'/messages/{correspondent.username}']:
+        assert signed_in.get(url, query_string={cursor: 'garbage'}).status_code == 404
+        assert signed_in.get(url).status_code == 200
@@ -0,0 +1,51 @@
+import threading
+
+import pytest
+from sqlalchemy import event
+
+import app as forum
+
+
+def count_queries(app, client, url):
+    # Only this thread's statements, from a cold cache
+    thread = threading.get_ident()
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == thread:
+            statements.append(statement)
+
+    forum.cache.clear()
+    with app.app_context():
+        engine = forum.db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(url)
+        response.get_data()
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    assert response.status_code == 200
+    return statements
+
+
+@pytest.fixture(scope='module')
+def topics(app, make_topic):
+    small = make_topic('Small thread', posts=1, comments_per_post=0)
+    large = make_topic('Large thread', posts=3 * app.config['POSTS_PER_PAGE'], comments_per_post=5)
+    return small.id, large.id
+
+
+def test_thread_page_query_count_is_constant(app, client, topics):
+    small, large = topics
+    few = count_queries(app, client, f'/topic/{small}')
+    many = count_queries(app, client, f'/topic/{large}')
+    assert len(few) == len(many)
+    # The topic, its two validator aggregates, one page of posts and their comments
+    assert len(many) <= 5
+
+
+def test_later_thread_pages_cost_the_same(app, client, topics):
+    _, large = topics
+    first = count_queries(app, client, f'/topic/{large}')
+    third = count_queries(app, client, f'/topic/{large}/page/3')
+    assert len(third) == len(first)
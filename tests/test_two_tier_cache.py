@@ -0,0 +1,72 @@
+import asyncio
+import queue
+import threading
+import time
+from uuid import uuid4
+
+import pytest
+
+from cache_backends import LRUCache, RedisCache, TwoTierCache
+from fake_redis import serve
+
+redis = pytest.importorskip('redis')
+
+@pytest.fixture(scope='module')
+def redis_port():
+    # The caches' listener threads stay subscribed until the process exits,
+    # so the server runs on a daemon thread for the rest of the session
+    ready = queue.Queue()
+    threading.Thread(target=asyncio.run, args=(serve('127.0.0.1', 0, ready.put),), daemon=True).start()
+    return ready.get(timeout=5)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail('timed out waiting for the cache invalidation')
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def caches(redis_port):
+    client = redis.Redis(host='127.0.0.1', port=redis_port)
+    client.flushdb()
+    # A channel per test: listeners from earlier tests are still subscribed
+    channel = f'test-invalidate-{uuid4().hex}'
+    pair = [TwoTierCache(RedisCache(host='127.0.0.1', port=redis_port), LRUCache(), channel=channel)
+            for _ in range(2)]
+    for cache in pair:
+        cache.get('warm-up')  # starts the invalidation listener
+    # Both listeners are subscribed once a publish reaches two clients
+    wait_for(lambda: client.publish(channel, 'probe:probe') == 2)
+    return pair
+
+
+def test_set_on_one_worker_evicts_the_others_local_copy(caches):
+    first, second = caches
+    first.set('greeting', 'hello')
+    assert second.get('greeting') == 'hello'
+    assert second.local.get('greeting') == 'hello'
+    first.set('greeting', 'bonjour')
+    wait_for(lambda: second.local.get('greeting') is None)
+    assert second.get('greeting') == 'bonjour'
+    assert second.stats()['invalidations_received'] >= 1
+
+
+def test_delete_on_one_worker_evicts_the_others_local_copy(caches):
+    first, second = caches
+    first.set('answer', 42)
+    assert second.get('answer') == 42
+    first.delete('answer')
+    wait_for(lambda: not second.local.has('answer'))
+    assert second.get('answer') is None
+
+
+def test_clear_empties_every_local_tier(caches):
+    first, second = caches
+    first.set('a', 1)
+    assert second.get('a') == 1
+    first.clear()
+    wait_for(lambda: not second.local.has('a'))
+    assert second.get('a') is None